@@ -0,0 +1,152 @@
+from falconjsonio.schema import request_schema, response_schema
+
+import falcon
+import io
+import json
+import logging
+
+
+BATCH_REQUEST_SCHEMA = {
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'properties': {
+            'method':   {'enum': ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']},
+            'path':     {'type': 'string', 'pattern': '^/'},
+            'body':     {},
+            'headers':  {'type': 'object', 'additionalProperties': {'type': 'string'}},
+        },
+        'required': ['method', 'path'],
+        'additionalProperties': False,
+    },
+}
+
+BATCH_RESPONSE_SCHEMA = {
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'properties': {
+            'status':   {'type': 'integer'},
+            'headers':  {'type': 'object'},
+            'body':     {},
+        },
+        'required': ['status'],
+    },
+}
+
+# Set in the environ of every operation, so that batches cannot be nested
+# whichever route they are reached through
+ENVIRON_MARKER = 'falconjsonio.batch'
+
+# Headers of the batch request that must not carry over to its operations
+_DROPPED_HEADERS = frozenset([
+    'HTTP_ACCEPT', 'HTTP_ACCEPT_ENCODING', 'HTTP_CONTENT_ENCODING', 'HTTP_IF_MATCH', 'HTTP_IF_NONE_MATCH',
+    'HTTP_IF_MODIFIED_SINCE', 'HTTP_IF_UNMODIFIED_SINCE', 'HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH',
+])
+
+# Headers of every operation whatever it asks for, as its body is encoded and
+# its response decoded as plain JSON
+_FORCED_HEADERS = {
+    'HTTP_ACCEPT':          'application/json',
+    'HTTP_ACCEPT_ENCODING': 'identity',
+}
+
+
+class _Response(object):
+    def __init__(self):
+        self.status     = None
+        self.headers    = []
+
+    def start_response(self, status, headers, exc_info=None):
+        self.status     = status
+        self.headers    = headers
+
+
+class BatchResource(object):
+    """
+    Resource running a list of {'method', 'path', 'body', 'headers'}
+    operations through a WSGI app, so that each goes through its middleware
+    (RequireJSON, JSONTranslator, ...) and responder as a request of its own,
+    and answering with their {'status', 'headers', 'body'} in the same order.
+
+    Operations inherit the headers of the batch request (authentication, ...)
+    other than those about its body, encoding and conditions, always ask for
+    uncompressed JSON, and run one after the other, or concurrently on
+    `executor` if one is given.
+    """
+    def __init__(self, app, executor=None, max_operations=100, logger=None):
+        if logger is None:
+            logger = logging.getLogger(__name__)
+        self.app            = app
+        self.executor       = executor
+        self.max_operations = max_operations
+        self.logger         = logger
+
+    def _environ(self, env, operation):
+        path, _, query_string = operation['path'].partition('?')
+        environ = dict((name, value) for name, value in env.items() if name not in _DROPPED_HEADERS)
+        environ.update({
+            'REQUEST_METHOD':   operation['method'],
+            'PATH_INFO':        path,
+            'QUERY_STRING':     query_string,
+            ENVIRON_MARKER:     True,
+        })
+        environ.pop('CONTENT_TYPE', None)
+        environ.pop('CONTENT_LENGTH', None)
+
+        body = b''
+        if 'body' in operation:
+            body = json.dumps(operation['body']).encode('utf-8')
+            environ['CONTENT_TYPE']     = 'application/json'
+            environ['CONTENT_LENGTH']   = str(len(body))
+        environ['wsgi.input'] = io.BytesIO(body)
+
+        for name, value in operation.get('headers', {}).items():
+            name = name.upper().replace('-', '_')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+            else:
+                environ['HTTP_' + name] = value
+        environ.pop('HTTP_CONTENT_ENCODING', None)
+        environ.update(_FORCED_HEADERS)
+        return environ
+
+    def _run(self, env, operation):
+        response = _Response()
+        try:
+            result = self.app(self._environ(env, operation), response.start_response)
+            try:
+                data = b''.join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+
+            content_type = next((value for name, value in response.headers if name.lower() == 'content-type'), '')
+            if not data:
+                body = None
+            elif 'json' in content_type:
+                body = json.loads(data.decode('utf-8'))
+            else:
+                body = data.decode('utf-8', 'replace')
+        except Exception:
+            self.logger.exception('Batch operation {0} {1} failed'.format(operation['method'], operation['path']))
+            return {'status': 500, 'body': None}
+
+        headers = dict(response.headers)
+        return {'status': int(response.status.split(' ', 1)[0]), 'headers': headers, 'body': body}
+
+    @request_schema(BATCH_REQUEST_SCHEMA)
+    @response_schema(BATCH_RESPONSE_SCHEMA)
+    def on_post(self, req, resp):
+        operations = req.context['doc']
+        if req.env.get(ENVIRON_MARKER):
+            raise falcon.HTTPBadRequest('Invalid operation', 'Batches cannot be nested')
+        if self.max_operations is not None and len(operations) > self.max_operations:
+            raise falcon.HTTPBadRequest('Too many operations', 'A batch may hold at most {0} operations'.format(self.max_operations))
+
+        if self.executor is None:
+            results = [self._run(req.env, operation) for operation in operations]
+        else:
+            results = list(self.executor.map(lambda operation: self._run(req.env, operation), operations))
+        resp.status = falcon.HTTP_200
+        req.context['result'] = results
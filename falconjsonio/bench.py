@@ -0,0 +1,238 @@
+"""
+Benchmarks for the decode/validate/encode pipeline of RequireJSON and
+JSONTranslator, driven in-process through a Falcon app.
+
+    python -m falconjsonio.bench --output before.json
+    # ... make changes ...
+    python -m falconjsonio.bench --output after.json --compare before.json
+"""
+import falconjsonio.codec, falconjsonio.metrics, falconjsonio.middleware, falconjsonio.schema
+
+import argparse
+import falcon, falcon.testing
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+
+PAYLOAD_SIZES = {'small': 1, 'medium': 100, 'large': 10000}
+
+FLAT_ITEM_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'id':       {'type': 'integer', 'minimum': 0},
+        'name':     {'type': 'string', 'maxLength': 64},
+        'email':    {'type': 'string'},
+        'active':   {'type': 'boolean'},
+        'score':    {'type': 'number'},
+    },
+    'required': ['id', 'name', 'email'],
+}
+
+NESTING_DEPTH = 6
+
+
+def _nested_item_schema(depth):
+    schema = {
+        'type': 'object',
+        'properties': {
+            'id':   {'type': 'integer'},
+            'tags': {'type': 'array', 'items': {'type': 'string'}},
+        },
+        'required': ['id'],
+    }
+    if depth:
+        schema['properties']['child'] = _nested_item_schema(depth - 1)
+        schema['required'].append('child')
+    return schema
+
+def _flat_item(i):
+    return {'id': i, 'name': 'name {0}'.format(i), 'email': 'user{0}@example.com'.format(i), 'active': i % 2 == 0, 'score': i / 3.0}
+
+def _nested_item(i, depth=NESTING_DEPTH):
+    item = {'id': i, 'tags': ['a', 'b', 'c']}
+    if depth:
+        item['child'] = _nested_item(i, depth - 1)
+    return item
+
+SCHEMAS = {
+    'simple': (FLAT_ITEM_SCHEMA, _flat_item),
+    'nested': (_nested_item_schema(NESTING_DEPTH), _nested_item),
+}
+
+
+def _make_resource(item_schema, compiled):
+    schema = {'type': 'array', 'items': item_schema}
+
+    class BenchResource(object):
+        @falconjsonio.schema.request_schema(schema, compiled=compiled)
+        @falconjsonio.schema.response_schema(schema, compiled=compiled)
+        def on_post(self, req, resp):
+            resp.status = falcon.HTTP_200
+            req.context['result'] = req.context['doc']
+
+    return BenchResource()
+
+def _make_app(resource, **translator_kwargs):
+    app = (getattr(falcon, 'App', None) or falcon.API)(
+        middleware=[
+            falconjsonio.middleware.RequireJSON(),
+            falconjsonio.middleware.JSONTranslator(**translator_kwargs),
+        ],
+    )
+    app.add_route('/bench', resource)
+    return app
+
+def _start_response(status, headers, exc_info=None):
+    if not status.startswith('200'):
+        raise RuntimeError('Benchmark request failed with {0}'.format(status))
+
+def _request(app, body):
+    env = falcon.testing.create_environ(path='/bench', method='POST', body=body, headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+    for chunk in app(env, _start_response):
+        pass
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run_scenario(schema_name, size_name, duration, codec, compiled, schema_encoding=False):
+    item_schema, make_item = SCHEMAS[schema_name]
+    body = json.dumps([make_item(i) for i in range(PAYLOAD_SIZES[size_name])]).encode('utf-8')
+    resource = _make_resource(item_schema, compiled)
+
+    # Throughput and latency, without instrumentation
+    app = _make_app(resource, codec=codec, schema_encoding=schema_encoding)
+    _request(app, body)
+    latencies = []
+    started = time.perf_counter()
+    while True:
+        start = time.perf_counter()
+        _request(app, body)
+        end = time.perf_counter()
+        latencies.append(end - start)
+        if end - started >= duration and len(latencies) >= 3:
+            break
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    # Per-stage latency
+    sink = falconjsonio.metrics.HistogramSink()
+    app = _make_app(resource, codec=codec, schema_encoding=schema_encoding, metrics=sink)
+    for i in range(min(len(latencies), 50)):
+        _request(app, body)
+    stages = {}
+    for (resource_name, responder, metric), histogram in sink.snapshot().items():
+        if metric not in falconjsonio.metrics.SIZE_METRICS:
+            stages[metric] = histogram['sum'] / histogram['count']
+
+    # Peak memory of a single request
+    app = _make_app(resource, codec=codec, schema_encoding=schema_encoding)
+    tracemalloc.start()
+    _request(app, body)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'schema':           schema_name,
+        'payload':          size_name,
+        'body_bytes':       len(body),
+        'requests':         len(latencies),
+        'requests_per_sec': len(latencies) / elapsed,
+        'latency': {
+            'mean': sum(latencies) / len(latencies),
+            'p50':  _percentile(latencies, 0.50),
+            'p99':  _percentile(latencies, 0.99),
+        },
+        'stages':           stages,
+        'peak_memory_bytes': peak,
+    }
+
+def run(duration=1.0, codec_name='json', compiled=False, schemas=None, payloads=None, schema_encoding=False):
+    codec = falconjsonio.codec.get_codec(codec_name)
+    results = []
+    for schema_name in schemas or sorted(SCHEMAS):
+        for size_name in payloads or sorted(PAYLOAD_SIZES, key=PAYLOAD_SIZES.get):
+            results.append(run_scenario(schema_name, size_name, duration, codec, compiled, schema_encoding))
+    return {
+        'python':   platform.python_version(),
+        'falcon':   falcon.__version__,
+        'codec':    codec.name,
+        'compiled': compiled,
+        'schema_encoding': schema_encoding,
+        'results':  results,
+    }
+
+
+def _format_results(run_results):
+    lines = ['{0:<8} {1:<8} {2:>12} {3:>10} {4:>10} {5:>10} {6:>10} {7:>10} {8:>12}'.format(
+        'schema', 'payload', 'req/s', 'p50 ms', 'p99 ms', 'decode ms', 'valid. ms', 'encode ms', 'peak KiB',
+    )]
+    for result in run_results['results']:
+        stages = result['stages']
+        lines.append('{0:<8} {1:<8} {2:>12.1f} {3:>10.3f} {4:>10.3f} {5:>10.3f} {6:>10.3f} {7:>10.3f} {8:>12.1f}'.format(
+            result['schema'], result['payload'], result['requests_per_sec'],
+            result['latency']['p50'] * 1000, result['latency']['p99'] * 1000,
+            stages.get('decode', 0) * 1000,
+            (stages.get('validate', 0) + stages.get('validate_response', 0)) * 1000,
+            stages.get('encode', 0) * 1000,
+            result['peak_memory_bytes'] / 1024.0,
+        ))
+    return '\n'.join(lines)
+
+def compare(baseline, current, tolerance):
+    """
+    Return a report of the throughput change of every scenario present in both
+    runs, and whether any scenario regressed by more than `tolerance` (a
+    fraction, e.g. 0.1 for 10%).
+    """
+    previous = dict(((result['schema'], result['payload']), result) for result in baseline['results'])
+    lines = []
+    regressed = False
+    for result in current['results']:
+        key = (result['schema'], result['payload'])
+        if key not in previous:
+            continue
+        change = result['requests_per_sec'] / previous[key]['requests_per_sec'] - 1
+        flag = ''
+        if change < -tolerance:
+            flag = '  REGRESSION'
+            regressed = True
+        lines.append('{0:<8} {1:<8} {2:>+8.1%} req/s{3}'.format(key[0], key[1], change, flag))
+    return '\n'.join(lines), regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--duration', type=float, default=1.0, help='Seconds to run each scenario for')
+    parser.add_argument('--codec', default='json', help="JSON codec name (default 'json')")
+    parser.add_argument('--compiled', action='store_true', help='Use compiled validators')
+    parser.add_argument('--schema-encoding', action='store_true', help='Encode responses from their schema')
+    parser.add_argument('--schema', action='append', choices=sorted(SCHEMAS), help='Only run this schema (repeatable)')
+    parser.add_argument('--payload', action='append', choices=sorted(PAYLOAD_SIZES), help='Only run this payload size (repeatable)')
+    parser.add_argument('--output', help='Save results as JSON to this file')
+    parser.add_argument('--compare', help='Compare against results previously saved with --output')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Throughput drop counted as a regression (default 0.1)')
+    args = parser.parse_args(argv)
+
+    results = run(args.duration, args.codec, args.compiled, args.schema, args.payload, args.schema_encoding)
+    print(_format_results(results))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            report, regressed = compare(json.load(baseline), results, args.tolerance)
+        print('')
+        print(report)
+        if regressed:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
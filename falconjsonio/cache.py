@@ -0,0 +1,68 @@
+import collections
+import threading
+import time
+
+
+class LRUCache(object):
+    """
+    Thread-safe, size-bounded cache evicting the least recently used entry,
+    with an optional time-to-live in seconds for every entry.
+    """
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize    = maxsize
+        self.ttl        = ttl
+        self.hits       = 0
+        self.misses     = 0
+        self.entries    = collections.OrderedDict()
+        self.lock       = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                expires, value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time.monotonic():
+                del self.entries[key]
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self.lock:
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def discard(self, predicate):
+        """
+        Remove every entry whose key satisfies predicate(key).
+        """
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size':     len(self.entries),
+                'maxsize':  self.maxsize,
+                'hits':     self.hits,
+                'misses':   self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,136 @@
+import json
+
+
+class JSONCodec(object):
+    """
+    Interface for the JSON implementation used by JSONTranslator.
+
+    loads() receives the raw request body as bytes, or as the bytearray it was
+    read or decompressed into, and may raise ValueError (including
+    UnicodeDecodeError) for malformed input.  dumps() returns the encoded
+    document as bytes.
+
+    array_framing holds the bytes that open an array, separate its items and
+    close it, for streaming arrays of unknown length, or None if the format
+    cannot encode those.
+    """
+    name = None
+    media_type = 'application/json'
+    array_framing = (b'[', b',', b']')
+
+    def loads(self, data):
+        raise NotImplementedError
+
+    def dumps(self, obj):
+        raise NotImplementedError
+
+
+class StdlibCodec(JSONCodec):
+    name = 'json'
+
+    def loads(self, data):
+        # The parser only works on str, so this is the one copy made
+        return json.loads(data.decode('utf-8'))
+
+    def dumps(self, obj):
+        return json.dumps(obj).encode('utf-8')
+
+
+class OrjsonCodec(JSONCodec):
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.loads = orjson.loads
+        self.dumps = orjson.dumps
+
+
+class UjsonCodec(JSONCodec):
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def loads(self, data):
+        return self._ujson.loads(data)
+
+    def dumps(self, obj):
+        return self._ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+class RapidjsonCodec(JSONCodec):
+    name = 'rapidjson'
+
+    def __init__(self):
+        import rapidjson
+        self._rapidjson = rapidjson
+
+    def loads(self, data):
+        return self._rapidjson.loads(data)
+
+    def dumps(self, obj):
+        return self._rapidjson.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+class MsgpackCodec(JSONCodec):
+    """
+    MessagePack, which has no arrays of unknown length: streamed results are
+    collected and encoded at once.
+    """
+    name = 'msgpack'
+    media_type = 'application/msgpack'
+    array_framing = None
+
+    def __init__(self):
+        import msgpack
+        self._msgpack = msgpack
+
+    def loads(self, data):
+        try:
+            return self._msgpack.unpackb(data, raw=False)
+        except (self._msgpack.UnpackException, TypeError) as error:
+            raise ValueError(str(error))
+
+    def dumps(self, obj):
+        return self._msgpack.packb(obj, use_bin_type=True)
+
+
+class CborCodec(JSONCodec):
+    name = 'cbor'
+    media_type = 'application/cbor'
+    # Indefinite-length array
+    array_framing = (b'\x9f', b'', b'\xff')
+
+    def __init__(self):
+        import cbor2
+        self._cbor2 = cbor2
+
+    def loads(self, data):
+        try:
+            return self._cbor2.loads(data)
+        except self._cbor2.CBORDecodeError as error:
+            raise ValueError(str(error))
+
+    def dumps(self, obj):
+        return self._cbor2.dumps(obj)
+
+
+# In order of preference
+_codecs = [OrjsonCodec, RapidjsonCodec, UjsonCodec, StdlibCodec]
+
+
+def get_codec(name=None):
+    """
+    Return a codec instance by name ('orjson', 'rapidjson', 'ujson' or
+    'json'), or the fastest one installed if no name is given.
+    """
+    for codec_cls in _codecs:
+        if name is not None and codec_cls.name != name:
+            continue
+        try:
+            return codec_cls()
+        except ImportError:
+            if name is not None:
+                raise
+    raise ValueError("Unknown JSON codec '{0}'".format(name))
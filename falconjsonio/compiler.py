@@ -0,0 +1,500 @@
+import dataclasses
+import json
+import numbers
+import re
+
+
+class UnsupportedSchema(Exception): pass
+
+
+# Keywords that carry no validation semantics
+_ANNOTATIONS = frozenset([
+    '$schema', 'id', '$id', '$comment', 'title', 'description', 'default', 'examples', 'definitions',
+    'readOnly', 'writeOnly',
+])
+
+_TYPE_CHECKS = {
+    'object':  'isinstance({0}, dict)',
+    'array':   'isinstance({0}, list)',
+    'string':  'isinstance({0}, str)',
+    'boolean': 'isinstance({0}, bool)',
+    'null':    '{0} is None',
+    'number':  '(isinstance({0}, _number) and not isinstance({0}, bool))',
+    'integer': '(isinstance({0}, int) and not isinstance({0}, bool))',
+    'integer_or_integral_float': '((isinstance({0}, int) and not isinstance({0}, bool)) or (isinstance({0}, float) and {0}.is_integer()))',
+}
+
+_SCALARS = (str, int, float, bool, type(None))
+
+
+class _Generator(object):
+    """
+    Turns a schema tree into the source of one Python function per
+    sub-schema, each returning whether an instance is valid.
+    """
+    def __init__(self, format_checker=None, float_integers=False, resolver=None):
+        self.format_checker = format_checker
+        self.float_integers = float_integers
+        self.resolver       = resolver
+        self.refs           = {}
+        self.lines          = []
+        self.namespace      = {'_number': (int, float, numbers.Number), '_format_checker': format_checker}
+
+    def constant(self, value):
+        name = '_c{0}'.format(len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def type_check(self, name, var):
+        if name == 'integer' and self.float_integers:
+            name = 'integer_or_integral_float'
+        try:
+            return _TYPE_CHECKS[name].format(var)
+        except KeyError:
+            raise UnsupportedSchema("Unknown type '{0}'".format(name))
+
+    def reserve(self):
+        name = '_v{0}'.format(len(self.namespace))
+        self.namespace[name] = None
+        return name
+
+    def function(self, schema):
+        # Like jsonschema, ignore anything alongside a $ref
+        if isinstance(schema, dict) and '$ref' in schema:
+            return self.ref(schema['$ref'])
+        name = self.reserve()
+        self.define(name, schema)
+        return name
+
+    def ref(self, ref):
+        if self.resolver is None:
+            raise UnsupportedSchema("'$ref' cannot be compiled without a resolver")
+
+        try:
+            url, resolved = self.resolver.resolve(ref)
+        except Exception:
+            # Leave unresolvable references for jsonschema to report
+            raise UnsupportedSchema("'$ref' {0!r} cannot be resolved".format(ref))
+        try:
+            return self.refs[url]
+        except KeyError:
+            pass
+
+        # Named before being defined, so that recursive references work
+        name = self.refs[url] = self.reserve()
+        self.resolver.push_scope(url)
+        try:
+            self.define(name, resolved)
+        finally:
+            self.resolver.pop_scope()
+        return name
+
+    def define(self, name, schema):
+        if schema is True or schema == {}:
+            body = []
+        elif schema is False:
+            body = ['return False']
+        elif isinstance(schema, dict):
+            body = self.body(schema)
+        else:
+            raise UnsupportedSchema('Schema must be an object or a boolean')
+
+        self.lines.append('def {0}(data):'.format(name))
+        self.lines.extend('    ' + line for line in body)
+        self.lines.append('    return True')
+        self.lines.append('')
+
+    def body(self, schema):
+        for keyword in schema:
+            if keyword not in _ANNOTATIONS and not hasattr(self, 'keyword_' + keyword):
+                raise UnsupportedSchema("Keyword '{0}' cannot be compiled".format(keyword))
+
+        body = []
+        for keyword, value in schema.items():
+            if keyword in _ANNOTATIONS:
+                continue
+            body.extend(getattr(self, 'keyword_' + keyword)(value, schema))
+        return body
+
+    def keyword_type(self, value, schema):
+        types = [value] if isinstance(value, str) else value
+        if not all(isinstance(name, str) for name in types):
+            raise UnsupportedSchema('Only named types can be compiled')
+        return ['if not ({0}): return False'.format(' or '.join(self.type_check(name, 'data') for name in types))]
+
+    def keyword_enum(self, value, schema):
+        if not all(isinstance(each, _SCALARS) for each in value):
+            raise UnsupportedSchema('Only scalar enums can be compiled')
+        return ['if not any(data == each and isinstance(data, bool) == isinstance(each, bool) for each in {0}): return False'.format(self.constant(tuple(value)))]
+
+    def keyword_const(self, value, schema):
+        return self.keyword_enum([value], schema)
+
+    def keyword_properties(self, value, schema):
+        lines = ['if isinstance(data, dict):']
+        for key, subschema in value.items():
+            lines.append('    if {0!r} in data and not {1}(data[{0!r}]): return False'.format(key, self.function(subschema)))
+        return lines if len(lines) > 1 else []
+
+    def keyword_required(self, value, schema):
+        if not isinstance(value, list):
+            raise UnsupportedSchema("Draft 3 style 'required' cannot be compiled")
+        if not value:
+            return []
+        return ['if isinstance(data, dict) and ({0}): return False'.format(' or '.join('{0!r} not in data'.format(key) for key in value))]
+
+    def keyword_additionalProperties(self, value, schema):
+        if 'patternProperties' in schema:
+            raise UnsupportedSchema("'additionalProperties' alongside 'patternProperties' cannot be compiled")
+        known = self.constant(frozenset(schema.get('properties', {})))
+        if value is True or value == {}:
+            return []
+        if value is False:
+            return ['if isinstance(data, dict) and any(key not in {0} for key in data): return False'.format(known)]
+        return [
+            'if isinstance(data, dict):',
+            '    for key, value in data.items():',
+            '        if key not in {0} and not {1}(value): return False'.format(known, self.function(value)),
+        ]
+
+    def keyword_minProperties(self, value, schema):
+        return ['if isinstance(data, dict) and len(data) < {0!r}: return False'.format(value)]
+
+    def keyword_maxProperties(self, value, schema):
+        return ['if isinstance(data, dict) and len(data) > {0!r}: return False'.format(value)]
+
+    def keyword_items(self, value, schema):
+        if isinstance(value, list):
+            raise UnsupportedSchema("Tuple style 'items' cannot be compiled")
+        return [
+            'if isinstance(data, list):',
+            '    for item in data:',
+            '        if not {0}(item): return False'.format(self.function(value)),
+        ]
+
+    def keyword_minItems(self, value, schema):
+        return ['if isinstance(data, list) and len(data) < {0!r}: return False'.format(value)]
+
+    def keyword_maxItems(self, value, schema):
+        return ['if isinstance(data, list) and len(data) > {0!r}: return False'.format(value)]
+
+    def keyword_minLength(self, value, schema):
+        return ['if isinstance(data, str) and len(data) < {0!r}: return False'.format(value)]
+
+    def keyword_maxLength(self, value, schema):
+        return ['if isinstance(data, str) and len(data) > {0!r}: return False'.format(value)]
+
+    def keyword_pattern(self, value, schema):
+        return ['if isinstance(data, str) and not {0}.search(data): return False'.format(self.constant(re.compile(value)))]
+
+    def keyword_format(self, value, schema):
+        # Formats are only checked when a format checker was supplied
+        if self.format_checker is None:
+            return []
+        return ['if not _format_checker.conforms(data, {0!r}): return False'.format(value)]
+
+    def _bound(self, value, schema, operator, exclusive_operator, exclusive_keyword):
+        if schema.get(exclusive_keyword) is True:
+            operator = exclusive_operator
+        return ['if {0} and data {1} {2!r}: return False'.format(self.type_check('number', 'data'), operator, value)]
+
+    def keyword_minimum(self, value, schema):
+        return self._bound(value, schema, '<', '<=', 'exclusiveMinimum')
+
+    def keyword_maximum(self, value, schema):
+        return self._bound(value, schema, '>', '>=', 'exclusiveMaximum')
+
+    def keyword_exclusiveMinimum(self, value, schema):
+        # Draft 4 booleans modify 'minimum', later drafts give the bound itself
+        if isinstance(value, bool):
+            return []
+        return ['if {0} and data <= {1!r}: return False'.format(self.type_check('number', 'data'), value)]
+
+    def keyword_exclusiveMaximum(self, value, schema):
+        if isinstance(value, bool):
+            return []
+        return ['if {0} and data >= {1!r}: return False'.format(self.type_check('number', 'data'), value)]
+
+    def keyword_allOf(self, value, schema):
+        return ['if not {0}(data): return False'.format(self.function(subschema)) for subschema in value]
+
+    def keyword_anyOf(self, value, schema):
+        return ['if not ({0}): return False'.format(' or '.join('{0}(data)'.format(self.function(subschema)) for subschema in value))]
+
+    def keyword_oneOf(self, value, schema):
+        return ['if ({0}) != 1: return False'.format(' + '.join('{0}(data)'.format(self.function(subschema)) for subschema in value))]
+
+    def keyword_not(self, value, schema):
+        return ['if {0}(data): return False'.format(self.function(value))]
+
+
+def compile_validator(validator):
+    """
+    Generate a specialised function for the schema of a jsonschema validator
+    instance, returning True if an instance is valid.
+
+    Raises UnsupportedSchema if the schema uses anything the compiler does not
+    know how to translate exactly.
+    """
+    generator = _Generator(
+        format_checker=getattr(validator, 'format_checker', None),
+        float_integers=validator.is_type(1.0, 'integer'),
+        resolver=getattr(validator, 'resolver', None),
+    )
+    name = generator.function(validator.schema)
+    exec(compile('\n'.join(generator.lines), '<falconjsonio compiled schema>', 'exec'), generator.namespace)
+    return generator.namespace[name]
+
+
+class CompiledValidator(object):
+    """
+    Wraps a jsonschema validator with a compiled check for the common case of
+    valid instances.  Invalid instances are handed to the wrapped validator, so
+    errors are exactly those jsonschema would have raised.
+    """
+    def __init__(self, validator):
+        self.validator  = validator
+        self.check      = compile_validator(validator)
+
+    def is_valid(self, instance):
+        return self.check(instance) or self.validator.is_valid(instance)
+
+    def validate(self, instance):
+        if not self.check(instance):
+            self.validator.validate(instance)
+
+    def iter_errors(self, instance):
+        if self.check(instance):
+            return iter(())
+        return self.validator.iter_errors(instance)
+
+    def __getattr__(self, name):
+        return getattr(self.validator, name)
+
+
+# Names of the fields of dataclass and attrs classes, by class
+_field_names = {}
+
+
+def object_fields(instance):
+    """
+    Return the fields of a dataclass or attrs instance as a dict (without
+    converting nested instances), or None for any other object.
+    """
+    cls = instance.__class__
+    try:
+        names = _field_names[cls]
+    except KeyError:
+        if dataclasses.is_dataclass(cls):
+            names = tuple(field.name for field in dataclasses.fields(cls))
+        elif hasattr(cls, '__attrs_attrs__'):
+            names = tuple(attribute.name for attribute in cls.__attrs_attrs__)
+        else:
+            names = None
+        _field_names[cls] = names
+    if names is None:
+        return None
+    return dict((name, getattr(instance, name)) for name in names)
+
+def to_plain(instance):
+    """
+    Convert the dataclass and attrs instances in a document to dicts.
+    """
+    if isinstance(instance, dict):
+        return dict((key, to_plain(value)) for key, value in instance.items())
+    if isinstance(instance, (list, tuple)):
+        return [to_plain(item) for item in instance]
+    if isinstance(instance, _SCALARS):
+        return instance
+    fields = object_fields(instance)
+    if fields is None:
+        return instance
+    return to_plain(fields)
+
+
+_INFINITY = float('inf')
+
+
+def _encode_number(value):
+    # Like the json module's defaults
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if value != value:
+        return 'NaN'
+    if value == _INFINITY:
+        return 'Infinity'
+    if value == -_INFINITY:
+        return '-Infinity'
+    return float.__repr__(value)
+
+
+class _EncoderGenerator(_Generator):
+    """
+    Generates, besides the checks of _Generator, one function per sub-schema
+    that checks an instance while appending its JSON encoding to a list, and
+    returns False as soon as the instance turns out to be invalid.
+
+    Sub-schemas with a single type are encoded without generic type dispatch
+    and objects in the order of their declared properties; anything else is
+    checked and then encoded generically.
+    """
+    def __init__(self, **kwargs):
+        super(_EncoderGenerator, self).__init__(**kwargs)
+        self.encoder_refs = {}
+        self.namespace.update({
+            '_encode_string':   json.encoder.encode_basestring_ascii,
+            '_encode_number':   _encode_number,
+            '_dumps':           json.JSONEncoder(separators=(',', ':')).encode,
+            '_object_fields':   object_fields,
+        })
+
+    def reserve_encoder(self):
+        name = '_e{0}'.format(len(self.namespace))
+        self.namespace[name] = None
+        return name
+
+    def encoder(self, schema):
+        if isinstance(schema, dict) and '$ref' in schema:
+            return self.encoder_ref(schema['$ref'])
+        name = self.reserve_encoder()
+        self.define_encoder(name, schema)
+        return name
+
+    def encoder_ref(self, ref):
+        if self.resolver is None:
+            raise UnsupportedSchema("'$ref' cannot be compiled without a resolver")
+
+        try:
+            url, resolved = self.resolver.resolve(ref)
+        except Exception:
+            raise UnsupportedSchema("'$ref' {0!r} cannot be resolved".format(ref))
+        try:
+            return self.encoder_refs[url]
+        except KeyError:
+            pass
+
+        name = self.encoder_refs[url] = self.reserve_encoder()
+        self.resolver.push_scope(url)
+        try:
+            self.define_encoder(name, resolved)
+        finally:
+            self.resolver.pop_scope()
+        return name
+
+    def define_encoder(self, name, schema):
+        kind = schema.get('type') if isinstance(schema, dict) else None
+        if kind == 'object':
+            body = self.encode_object(schema)
+        elif kind == 'array':
+            body = self.encode_array(schema)
+        elif kind == 'string':
+            body = self.checks(schema) + ['out.append(_encode_string(data))']
+        elif kind in ('integer', 'number'):
+            body = self.checks(schema) + ['out.append(_encode_number(data))']
+        elif kind == 'boolean':
+            body = self.checks(schema) + ["out.append('true' if data else 'false')"]
+        elif kind == 'null':
+            body = self.checks(schema) + ["out.append('null')"]
+        else:
+            body = ['if not {0}(data): return False'.format(self.function(schema)), 'out.append(_dumps(data))']
+
+        self.lines.append('def {0}(data, out):'.format(name))
+        self.lines.extend('    ' + line for line in body)
+        self.lines.append('    return True')
+        self.lines.append('')
+
+    def checks(self, schema, handled=()):
+        """
+        The checks of all keywords of a schema but those the encoder handles.
+        """
+        return self.body(dict((keyword, value) for keyword, value in schema.items() if keyword not in handled))
+
+    def encode_object(self, schema):
+        properties = schema.get('properties', {})
+        required = schema.get('required', [])
+        additional = schema.get('additionalProperties', True)
+        if not isinstance(required, list):
+            raise UnsupportedSchema("Draft 3 style 'required' cannot be compiled")
+        if 'patternProperties' in schema:
+            raise UnsupportedSchema("'patternProperties' cannot be compiled")
+
+        lines = [
+            'if not isinstance(data, dict):',
+            '    data = _object_fields(data)',
+            '    if data is None: return False',
+        ]
+        lines.extend(self.checks(schema, ('properties', 'required', 'additionalProperties')))
+        if required:
+            lines.append('if {0}: return False'.format(' or '.join('{0!r} not in data'.format(key) for key in required)))
+        known = self.constant(frozenset(properties))
+        if additional is False:
+            lines.append('if any(key not in {0} for key in data): return False'.format(known))
+
+        lines.append("separator = '{'")
+        for key, subschema in properties.items():
+            lines.extend([
+                'if {0!r} in data:'.format(key),
+                '    out.append(separator + {0!r})'.format(json.encoder.encode_basestring_ascii(key) + ':'),
+                '    if not {0}(data[{1!r}], out): return False'.format(self.encoder(subschema), key),
+                "    separator = ','",
+            ])
+        if additional is not False:
+            lines.extend([
+                'for key, value in data.items():',
+                '    if key not in {0}:'.format(known),
+                '        if not isinstance(key, str): return False',
+                "        out.append(separator + _encode_string(key) + ':')",
+                "        separator = ','",
+            ])
+            if additional is True or additional == {}:
+                lines.append('        out.append(_dumps(value))')
+            else:
+                lines.append('        if not {0}(value, out): return False'.format(self.encoder(additional)))
+        lines.append("out.append('{}' if separator == '{' else '}')")
+        return lines
+
+    def encode_array(self, schema):
+        items = schema.get('items', {})
+        if isinstance(items, list):
+            raise UnsupportedSchema("Tuple style 'items' cannot be compiled")
+
+        lines = self.checks(schema, ('items',))
+        lines.append("separator = '['")
+        lines.append('for item in data:')
+        lines.append('    out.append(separator)')
+        if items is True or items == {}:
+            lines.append('    out.append(_dumps(item))')
+        else:
+            lines.append('    if not {0}(item, out): return False'.format(self.encoder(items)))
+        lines.append("    separator = ','")
+        lines.append("out.append('[]' if separator == '[' else ']')")
+        return lines
+
+
+class SchemaEncoder(object):
+    """
+    Checks and encodes documents as JSON in a single pass, with a function
+    generated from the schema of a jsonschema validator instance.
+
+    encode() returns the UTF-8 encoded document, or None if the document is
+    invalid or cannot be encoded this way; callers then fall back to
+    validating and encoding it the usual way, which also reports the errors.
+    """
+    def __init__(self, validator):
+        generator = _EncoderGenerator(
+            format_checker=getattr(validator, 'format_checker', None),
+            float_integers=validator.is_type(1.0, 'integer'),
+            resolver=getattr(validator, 'resolver', None),
+        )
+        name = generator.encoder(validator.schema)
+        exec(compile('\n'.join(generator.lines), '<falconjsonio schema encoder>', 'exec'), generator.namespace)
+        self._encode = generator.namespace[name]
+
+    def encode(self, instance):
+        out = []
+        try:
+            if not self._encode(instance, out):
+                return None
+        except (TypeError, ValueError, RecursionError):
+            return None
+        return ''.join(out).encode('utf-8')
@@ -0,0 +1,203 @@
+import zlib
+
+
+# Limit on decompressed request bodies when no body size limit is configured
+DEFAULT_MAX_DECOMPRESSED_SIZE = 16 * 1024 * 1024
+
+
+class DecompressionError(ValueError):
+    pass
+
+
+class Encoding(object):
+    """
+    A content coding (RFC 7231, section 3.1.2.1) for request and response
+    bodies.
+
+    compressor() returns an object with compress(data) and flush() methods,
+    like zlib.compressobj().  decompress() yields the decompressed data in
+    pieces of at most about chunk_size bytes, so that callers can stop as soon
+    as too much has come out, and raises DecompressionError for malformed or
+    truncated input.
+    """
+    name = None
+
+    def compressor(self):
+        raise NotImplementedError
+
+    def decompress(self, data, chunk_size):
+        raise NotImplementedError
+
+
+class _ZlibEncoding(Encoding):
+    wbits = None
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compressor(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, self.wbits)
+
+    def decompress(self, data, chunk_size):
+        decompressor = zlib.decompressobj(self.wbits)
+        try:
+            while data:
+                yield decompressor.decompress(data, chunk_size)
+                data = decompressor.unconsumed_tail
+            yield decompressor.flush()
+        except zlib.error as error:
+            raise DecompressionError(str(error))
+        if not decompressor.eof:
+            raise DecompressionError('Truncated {0} data'.format(self.name))
+
+
+class GzipEncoding(_ZlibEncoding):
+    name = 'gzip'
+    wbits = 16 + zlib.MAX_WBITS
+
+
+class DeflateEncoding(_ZlibEncoding):
+    name = 'deflate'
+    wbits = zlib.MAX_WBITS
+
+
+class _BrotliCompressor(object):
+    def __init__(self, compressor):
+        self._compressor = compressor
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+class BrotliEncoding(Encoding):
+    name = 'br'
+    # Input fed at once to decompressors without an output limit
+    input_size = 1024
+
+    def __init__(self, quality=4):
+        import brotli
+        self._brotli = brotli
+        self.quality = quality
+
+    def compressor(self):
+        return _BrotliCompressor(self._brotli.Compressor(quality=self.quality))
+
+    def decompress(self, data, chunk_size):
+        decompressor = self._brotli.Decompressor()
+        try:
+            if hasattr(decompressor, 'can_accept_more_data'):
+                chunk = decompressor.process(data, output_buffer_limit=chunk_size)
+                while chunk:
+                    yield chunk
+                    if decompressor.is_finished():
+                        break
+                    chunk = decompressor.process(b'', output_buffer_limit=chunk_size)
+            else:
+                # Older versions cannot limit their output, so only feed them
+                # a little input at a time
+                for start in range(0, len(data), self.input_size):
+                    yield decompressor.process(data[start:start + self.input_size])
+        except self._brotli.error as error:
+            raise DecompressionError(str(error))
+        if not decompressor.is_finished():
+            raise DecompressionError('Truncated br data')
+
+
+class ZstdEncoding(Encoding):
+    name = 'zstd'
+    # A few bytes of input can make a whole block of output
+    input_size = 256
+
+    def __init__(self, level=3):
+        import zstandard
+        self._zstandard = zstandard
+        self.level = level
+
+    def compressor(self):
+        return self._zstandard.ZstdCompressor(level=self.level).compressobj()
+
+    def decompress(self, data, chunk_size):
+        # Decompression objects cannot limit their output, so only feed them
+        # a little input at a time
+        decompressor = self._zstandard.ZstdDecompressor().decompressobj()
+        try:
+            for start in range(0, len(data), self.input_size):
+                yield decompressor.decompress(data[start:start + self.input_size])
+        except self._zstandard.ZstdError as error:
+            raise DecompressionError(str(error))
+        if not decompressor.eof:
+            raise DecompressionError('Truncated zstd data')
+
+
+# In order of preference for responses
+_encodings = [ZstdEncoding, BrotliEncoding, GzipEncoding, DeflateEncoding]
+
+
+def available_encodings():
+    """
+    Return an instance of every encoding whose library is installed, in order
+    of preference.
+    """
+    encodings = []
+    for encoding_cls in _encodings:
+        try:
+            encodings.append(encoding_cls())
+        except ImportError:
+            pass
+    return encodings
+
+
+def decompress(encoding, data, limit, chunk_size=64 * 1024):
+    """
+    Decompress data into a bytearray, returning None instead if it
+    decompresses to more than `limit` bytes (unless `limit` is None).
+    """
+    body = bytearray()
+    for chunk in encoding.decompress(data, chunk_size):
+        body += chunk
+        if limit is not None and len(body) > limit:
+            return None
+    return body
+
+
+def _accepted(header):
+    """
+    Parse an Accept-Encoding header into {coding: quality}.
+    """
+    accepted = {}
+    for item in header.split(','):
+        parts = item.split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for parameter in parts[1:]:
+            name, _, value = parameter.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+def choose_encoding(header, encodings):
+    """
+    Return the encoding the client prefers according to its Accept-Encoding
+    header, ties going to the earliest in `encodings`, or None to send the
+    response uncompressed.
+    """
+    if not header:
+        return None
+    accepted = _accepted(header)
+    best = None
+    best_quality = 0.0
+    for encoding in encodings:
+        quality = accepted.get(encoding.name, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best = encoding
+            best_quality = quality
+    return best
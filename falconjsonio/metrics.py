@@ -0,0 +1,152 @@
+import bisect
+import collections
+import falcon
+import threading
+import time
+
+
+# Stage timings, in seconds
+READ                = 'read'
+DECODE              = 'decode'
+VALIDATE            = 'validate'
+ENCODE              = 'encode'
+VALIDATE_RESPONSE   = 'validate_response'
+# Body sizes, in bytes
+REQUEST_SIZE        = 'request_size'
+RESPONSE_SIZE       = 'response_size'
+
+SIZE_METRICS = frozenset([REQUEST_SIZE, RESPONSE_SIZE])
+
+DEFAULT_TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+DEFAULT_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class MetricsSink(object):
+    """
+    Receives measurements from JSONTranslator, labelled with the resource
+    ('module.Class') and responder ('on_post', ...) they were taken for.
+    """
+    def observe(self, resource, responder, metric, value):
+        raise NotImplementedError
+
+
+class CallbackSink(MetricsSink):
+    """
+    Hands every measurement to callback(resource, responder, metric, value).
+    """
+    def __init__(self, callback):
+        self.callback = callback
+
+    def observe(self, resource, responder, metric, value):
+        self.callback(resource, responder, metric, value)
+
+
+class _Histogram(object):
+    def __init__(self, buckets):
+        self.buckets    = buckets
+        self.counts     = [0] * (len(buckets) + 1)
+        self.count      = 0
+        self.sum        = 0
+
+
+class HistogramSink(MetricsSink):
+    """
+    Keeps a cumulative histogram in memory for every resource, responder and
+    metric.
+    """
+    def __init__(self, time_buckets=DEFAULT_TIME_BUCKETS, size_buckets=DEFAULT_SIZE_BUCKETS):
+        self.time_buckets   = tuple(time_buckets)
+        self.size_buckets   = tuple(size_buckets)
+        self.histograms     = collections.OrderedDict()
+        self.lock           = threading.Lock()
+
+    def observe(self, resource, responder, metric, value):
+        key = (resource, responder, metric)
+        with self.lock:
+            try:
+                histogram = self.histograms[key]
+            except KeyError:
+                histogram = self.histograms[key] = _Histogram(self.size_buckets if metric in SIZE_METRICS else self.time_buckets)
+            histogram.counts[bisect.bisect_left(histogram.buckets, value)] += 1
+            histogram.count += 1
+            histogram.sum += value
+
+    def snapshot(self):
+        """
+        Return {(resource, responder, metric): {'count', 'sum', 'buckets'}},
+        where buckets is a list of (upper bound, cumulative count) pairs ending
+        with an infinite bound.
+        """
+        with self.lock:
+            snapshot = {}
+            for key, histogram in self.histograms.items():
+                cumulative = 0
+                buckets = []
+                for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    buckets.append((bound, cumulative))
+                snapshot[key] = {'count': histogram.count, 'sum': histogram.sum, 'buckets': buckets}
+            return snapshot
+
+    def prometheus_text(self, prefix='falconjsonio'):
+        """
+        Render the histograms in the Prometheus text exposition format.
+        """
+        lines = []
+        last = None
+        # Each metric family must come as one group, under its TYPE line
+        for (resource, responder, metric), histogram in sorted(self.snapshot().items(), key=lambda item: (item[0][2], item[0][0], item[0][1])):
+            name = '{0}_{1}_{2}'.format(prefix, metric, 'bytes' if metric in SIZE_METRICS else 'seconds')
+            if name != last:
+                last = name
+                lines.append('# TYPE {0} histogram'.format(name))
+            labels = 'resource="{0}",responder="{1}"'.format(resource, responder)
+            for bound, count in histogram['buckets']:
+                lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(name, labels, '+Inf' if bound == float('inf') else repr(bound), count))
+            lines.append('{0}_sum{{{1}}} {2!r}'.format(name, labels, histogram['sum']))
+            lines.append('{0}_count{{{1}}} {2}'.format(name, labels, histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+
+class PrometheusResource(object):
+    """
+    Falcon resource serving the histograms of a HistogramSink for Prometheus to
+    scrape, e.g. app.add_route('/metrics', PrometheusResource(sink)).
+    """
+    def __init__(self, sink, prefix='falconjsonio'):
+        self.sink   = sink
+        self.prefix = prefix
+
+    def on_get(self, req, resp):
+        resp.status = falcon.HTTP_200
+        resp.content_type = 'text/plain; version=0.0.4'
+        resp.data = self.sink.prometheus_text(self.prefix).encode('utf-8')
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_TIMER = _NullTimer()
+
+
+class Timer(object):
+    """
+    Context manager reporting the time spent inside it to a sink.
+    """
+    def __init__(self, sink, resource, responder, metric):
+        self.sink       = sink
+        self.resource   = resource
+        self.responder  = responder
+        self.metric     = metric
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.sink.observe(self.resource, self.responder, self.metric, time.perf_counter() - self.start)
+        return False
@@ -1,105 +1,1224 @@
+from falconjsonio import compression, metrics, ndjson, parallel, patch
+from falconjsonio.cache import LRUCache
+from falconjsonio.codec import StdlibCodec
+from falconjsonio.compiler import SchemaEncoder, UnsupportedSchema, object_fields, to_plain
+from falconjsonio.metrics import NULL_TIMER, Timer
+from falconjsonio.policy import Always
+from falconjsonio.schema import derive_validator
+
+import asyncio
+import collections
 import falcon
+import hashlib
+import itertools
 import json
 import jsonschema
 import logging
+import threading
+import time
+
+
+_REQUEST_METHOD_NAMES = {'POST': 'on_post', 'PUT': 'on_put', 'PATCH': 'on_patch'}
+_RESPONSE_METHOD_NAMES = {'POST': 'on_post', 'PUT': 'on_put', 'PATCH': 'on_patch', 'GET': 'on_get', 'DELETE': 'on_delete'}
+
+# Renamed in Falcon 3
+_HTTPPayloadTooLarge = getattr(falcon, 'HTTPPayloadTooLarge', None) or falcon.HTTPRequestEntityTooLarge
+
+# Validation cache verdict for request bodies that passed validation
+_VALID = object()
+
+# Stands for an NDJSON record that was skipped
+_SKIPPED = object()
 
+_Route = collections.namedtuple('_Route', ['resource_name', 'responder', 'request_schema', 'response_schema', 'response_validation', 'etag', 'response_cache'])
+_NO_ROUTE = _Route(None, None, None, None, None, None, None)
 
-def _get_request_schema(req, resource):
-    if resource is None or req.method not in ['POST', 'PUT', 'PATCH']:
+# (resource class, HTTP method) -> _Route, shared by both middlewares so that
+# the lookups below are only ever done once per route
+_route_cache = {}
+
+
+def _lookup(resource, method_name, attr):
+    if method_name is None:
         return None
 
-    # First try to get schema from method itself
-    schema = getattr(
-        getattr(resource, {'POST': 'on_post', 'PUT': 'on_put', 'PATCH': 'on_patch'}[req.method], None),
-        '__request_schema__',
+    # First try to get value from method itself
+    return getattr(
+        getattr(resource, method_name, None),
+        '__{0}__'.format(attr),
         None
-    # Otherwise, fall back to schema defined directly in class
-    ) or getattr(resource, '__request_schemas__', {}).get(
-        {'POST': 'on_post', 'PUT': 'on_put', 'PATCH': 'on_patch'}[req.method]
+    # Otherwise, fall back to value defined directly in class
+    ) or getattr(resource, '__{0}s__'.format(attr), {}).get(method_name)
+
+def _resolve_route(resource, method):
+    if resource is None:
+        return _NO_ROUTE
+
+    key = (resource.__class__, method)
+    try:
+        return _route_cache[key]
+    except KeyError:
+        pass
+
+    request_method_name = _REQUEST_METHOD_NAMES.get(method)
+    response_method_name = _RESPONSE_METHOD_NAMES.get(method)
+    route = _route_cache[key] = _Route(
+        resource_name='{0}.{1}'.format(resource.__module__, resource.__class__.__name__),
+        responder='on_' + method.lower(),
+        request_schema=_lookup(resource, request_method_name, 'request_schema'),
+        response_schema=_lookup(resource, response_method_name, 'response_schema'),
+        response_validation=_lookup(resource, response_method_name, 'response_validation'),
+        etag=_lookup(resource, response_method_name, 'etag'),
+        response_cache=_lookup(resource, response_method_name, 'response_cache'),
     )
-    return schema
+    return route
+
+# Keywords of an array schema that do not constrain the items of a stream
+_STREAM_NEUTRAL_KEYWORDS = frozenset([
+    'type', 'title', 'description', 'default', 'examples', '$comment', '$schema', 'id', '$id', 'definitions', '$defs',
+])
+
+
+def _dereference(validator):
+    """
+    The schema of a validator once its $refs are followed, as (url it was
+    found at or None, schema).
+    """
+    schema = validator.schema
+    url = None
+    for _ in range(100):
+        if not isinstance(schema, dict) or '$ref' not in schema:
+            return url, schema
+        url, schema = validator.resolver.resolve(schema['$ref'])
+    raise jsonschema.exceptions.RefResolutionError('Too many nested references')
+
+def _split_array(validator):
+    """
+    Split the schema of a validator, following its $refs, into the rest of an
+    array schema and the schema of its items: (rest, items), or None if the
+    schema does not give all its items one schema.
+    """
+    url, schema = _dereference(validator)
+    if not isinstance(schema, dict) or not isinstance(schema.get('items'), dict):
+        return None
 
-def _get_response_schema(resource, req):
+    items = schema['items']
+    if url is not None:
+        # Refer to the items where they are, so that the $refs they hold are
+        # resolved against their own document
+        base, _, fragment = url.partition('#')
+        if not fragment or fragment.startswith('/'):
+            items = {'$ref': '{0}#{1}/items'.format(base, fragment)}
+    rest = dict((keyword, value) for keyword, value in schema.items() if keyword != 'items')
+    return rest, items
+
+# id(response validator) -> (validator, validator for each item of a streamed
+# result or None, validator for the whole stream once collected or None)
+_stream_validators = LRUCache(1024)
+
+
+def _get_stream_validators(validator):
+    """
+    The validators of a streamed result: one for its items, as they come, and
+    one for the whole array, for the constraints that cannot be checked an
+    item at a time (e.g. minItems, or schemas not splittable into items).
+    """
+    entry = _stream_validators.get(id(validator))
+    if entry is None or entry[0] is not validator:
+        split = _split_array(validator)
+        if split is None:
+            entry = (validator, None, validator)
+        else:
+            rest, items = split
+            constrained = any(keyword not in _STREAM_NEUTRAL_KEYWORDS for keyword in rest)
+            entry = (validator, derive_validator(validator, items), derive_validator(validator, rest) if constrained else None)
+        _stream_validators.set(id(validator), entry)
+    return entry[1:]
+
+# id(request validator) -> (validator for the array without its items or None,
+# validator for the items), or None if the schema is not for an array of items
+_array_validators = {}
+
+
+def _get_array_validators(validator):
     try:
-        method_name = {'POST': 'on_post', 'PUT': 'on_put', 'PATCH': 'on_patch', 'GET': 'on_get', 'DELETE': 'on_delete'}[req.method]
+        return _array_validators[id(validator)]
     except KeyError:
-        return
+        pass
 
-    # First try to get schema from method itself
-    return getattr(
-        getattr(resource, method_name, None),
-        '__response_schema__',
-        None
-    # Otherwise, fall back to schema defined directly in class
-    ) or getattr(resource, '__response_schemas__', {}).get(method_name)
+    split = _split_array(validator)
+    if split is None:
+        validators = None
+    else:
+        rest, items = split
+        validators = (derive_validator(validator, rest) if rest else None, derive_validator(validator, items))
+    _array_validators[id(validator)] = validators
+    return validators
+
+def _get_record_validator(validator):
+    """
+    The validator for the records of an NDJSON body: that of the items of an
+    array schema, or else that of the whole schema.  Raises ValueError for
+    array schemas that do not give all their items one schema.
+    """
+    if validator is None:
+        return None
+    validators = _get_array_validators(validator)
+    if validators is not None:
+        return validators[1]
+    schema = _dereference(validator)[1]
+    if isinstance(schema, dict) and (schema.get('type') == 'array' or 'items' in schema):
+        raise ValueError('NDJSON records cannot be validated against an array schema without a single items schema')
+    return validator
+
+def _object_schema(schema):
+    """
+    The schema of the objects a response is made of: the schema itself, or
+    its items schema for an array.
+    """
+    if schema.get('type') == 'array' and isinstance(schema.get('items'), dict):
+        return schema['items']
+    return schema
+
+def _project_schema(schema, fields):
+    if _object_schema(schema) is not schema:
+        return dict(schema, items=_project_schema(schema['items'], fields))
+    projected = dict(schema, properties=dict((name, value) for name, value in schema['properties'].items() if name in fields))
+    if 'required' in schema:
+        projected['required'] = [name for name in schema['required'] if name in fields]
+    return projected
+
+def _project(result, fields):
+    if isinstance(result, list):
+        return [_project(item, fields) for item in result]
+    values = result if isinstance(result, dict) else object_fields(result)
+    if values is None:
+        return result
+    return dict((name, value) for name, value in values.items() if name in fields)
+
+# (id(response validator), fields) -> (validator, validator of the projected
+# schema); bounded, as clients choose the fields
+_projected_validators = LRUCache(1024)
+
+
+def _get_projected_validator(validator, fields):
+    key = (id(validator), fields)
+    entry = _projected_validators.get(key)
+    if entry is None or entry[0] is not validator:
+        entry = (validator, derive_validator(validator, _project_schema(validator.schema, fields)))
+        _projected_validators.set(key, entry)
+    return entry[1]
+
+# id(response validator) -> (validator, SchemaEncoder or None if its schema
+# cannot be encoded that way)
+_encoders = LRUCache(1024)
+
+
+def _get_encoder(validator):
+    entry = _encoders.get(id(validator))
+    if entry is None or entry[0] is not validator:
+        try:
+            encoder = SchemaEncoder(validator)
+        except UnsupportedSchema:
+            encoder = None
+        entry = (validator, encoder)
+        _encoders.set(id(validator), entry)
+    return entry[1]
+
+# (id(request validator), path) -> (validator, validator for the values a
+# patch may set at that path, or None if the schema does not allow it)
+_patch_validators = LRUCache(1024)
+
+
+def _get_patch_validator(validator, path):
+    key = (id(validator), path)
+    entry = _patch_validators.get(key)
+    if entry is None or entry[0] is not validator:
+        schema = patch.schema_at(validator.schema, path, _resolver(validator))
+        entry = (validator, derive_validator(validator, schema) if schema is not None else None)
+        _patch_validators.set(key, entry)
+    return entry[1]
+
+def _resolver(validator):
+    return lambda ref: validator.resolver.resolve(ref)[1]
+
+def prime_schema_cache(resource):
+    """
+    Resolve the schemas of every responder of a resource up front, e.g. right
+    after add_route(), instead of on the first request to each method.
+    """
+    for method in _RESPONSE_METHOD_NAMES:
+        _resolve_route(resource, method)
+
+def clear_schema_cache():
+    """
+    Forget all resolved schemas, e.g. after decorating a resource class at
+    runtime.
+    """
+    _route_cache.clear()
+    _stream_validators.clear()
+    _array_validators.clear()
+    _projected_validators.clear()
+    _encoders.clear()
+    _patch_validators.clear()
+
+
+def _json_pointer(path):
+    return ''.join('/' + str(part).replace('~', '~0').replace('/', '~1') for part in path)
+
+def _error_summary(error):
+    return {'path': _json_pointer(error.absolute_path), 'keyword': error.validator}
+
+def _etag_matches(if_none_match, etag, encodings):
+    """
+    Whether an If-None-Match header matches an ETag, or the ETag of the same
+    document in one of the content encodings.
+    """
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        # If-None-Match uses the weak comparison
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag or any(tag == _encoded_etag(etag, encoding) for encoding in encodings):
+            return True
+    return False
+
+def _encoded_etag(etag, encoding):
+    return '{0}-{1}"'.format(etag[:-1], encoding.name)
+
+# Response headers set by JSONTranslator itself for every request
+_NEGOTIATED_HEADERS = frozenset(['content-type', 'content-length', 'content-encoding', 'vary', 'etag'])
+
+
+def _cacheable_headers(resp):
+    """
+    The headers a responder set, to replay along with its cached response.
+    """
+    # Falcon < 3 has no public accessor for them
+    headers = resp.headers if hasattr(type(resp), 'headers') else resp._headers
+    return dict((name, value) for name, value in headers.items() if name.lower() not in _NEGOTIATED_HEADERS)
+
+
+
+class _BadRequest(falcon.HTTPBadRequest):
+    """
+    400 error optionally carrying a list of validation errors in its body.
+    """
+    def __init__(self, title, description, errors=None):
+        super(_BadRequest, self).__init__(title, description)
+        self.errors = errors
+
+    def to_dict(self, obj_type=dict):
+        obj = super(_BadRequest, self).to_dict(obj_type)
+        if self.errors is not None:
+            obj['errors'] = self.errors
+        return obj
 
 
 class _null_handler(logging.Handler):
     def emit(self, record):
         pass
 
+def _media_type(content_type):
+    return content_type.split(';', 1)[0].strip().lower()
+
+
+class _StreamEncoder(object):
+    """
+    Validates, encodes and compresses the items of a streamed result as they
+    are fed to it, returning the output in chunks of about chunk_size bytes.
+
+    Items are checked against `validator` as they come; with an
+    `array_validator` they are also collected, and checked as a whole before
+    the array is closed.
+    """
+    def __init__(self, translator, route, codec, validator, array_validator, policy, fields, compressor):
+        self.translator         = translator
+        self.route              = route
+        self.codec              = codec
+        self.validator          = validator
+        self.array_validator    = array_validator
+        self.policy             = policy
+        self.fields             = fields
+        self.compressor         = compressor
+        self.collected          = [] if array_validator is not None else None
+        self.index              = 0
+        self.done               = False
+        self.encoding           = 0.0
+        self.encoded            = 0
+        # Formats that cannot encode an array before knowing its length
+        # still validate the items as they come, but encode them at once
+        self.items              = [] if codec.array_framing is None else None
+        if self.items is None:
+            self.chunk          = [codec.array_framing[0]]
+            self.size           = len(codec.array_framing[0])
+            self.total          = 0
+
+    def _compress(self, data):
+        return self.compressor.compress(data) if self.compressor is not None else data
+
+    def _finish(self, data):
+        self.done = True
+        data = self._compress(data)
+        if self.compressor is not None:
+            data += self.compressor.flush()
+        return data
+
+    def feed(self, item):
+        """
+        Add an item, returning the output it completes (possibly empty).
+        """
+        if self.done:
+            return b''
+        if self.fields is not None:
+            item = _project(item, self.fields)
+        index = self.index
+        self.index += 1
+
+        translator = self.translator
+        if self.validator is not None and not translator._validate_response(self.route, self.validator, self.policy, item, 'item {0}'.format(index)):
+            # The status has already been sent, so all we can do is cut the
+            # document short so that it fails to parse
+            return self._finish(b'' if self.items is not None else b''.join(self.chunk))
+        if self.collected is not None:
+            self.collected.append(item)
+        if self.items is not None:
+            self.items.append(item)
+            return b''
+
+        if translator.metrics is not None:
+            start = time.perf_counter()
+            encoded = self.codec.dumps(item)
+            self.encoding += time.perf_counter() - start
+        else:
+            encoded = self.codec.dumps(item)
+        self.encoded += len(encoded)
+        separator = self.codec.array_framing[1]
+        if index and separator:
+            self.chunk.append(separator)
+            self.size += len(separator)
+        self.chunk.append(encoded)
+        self.size += len(encoded)
+        if self.size < translator.chunk_size:
+            return b''
+        data = b''.join(self.chunk)
+        self.total += self.size
+        self.chunk = []
+        self.size = 0
+        return self._compress(data)
+
+    def feed_many(self, items):
+        return b''.join([self.feed(item) for item in items])
+
+    def close(self):
+        """
+        Return the rest of the output once all items have been fed.
+        """
+        if self.done:
+            return b''
+        translator = self.translator
+        if self.collected is not None and not translator._validate_response(self.route, self.array_validator, self.policy, self.collected):
+            return self._finish(b'' if self.items is not None else b''.join(self.chunk))
+        if self.items is not None:
+            with translator._timer(self.route, metrics.ENCODE):
+                data = self.codec.dumps(self.items)
+            translator._observe(self.route, metrics.RESPONSE_SIZE, len(data))
+        else:
+            end_array = self.codec.array_framing[2]
+            self.chunk.append(end_array)
+            data = b''.join(self.chunk)
+            translator._observe(self.route, metrics.ENCODE, self.encoding)
+            translator._observe(self.route, metrics.RESPONSE_SIZE, self.total + self.size + len(end_array))
+        return self._finish(data)
+
+    def iterate(self, items):
+        for item in items:
+            data = self.feed(item)
+            if data:
+                yield data
+            if self.done:
+                return
+        yield self.close()
+
+    def _next_chunk(self, iterator):
+        """
+        Pull items until some output is ready, returning None once done.
+        """
+        if self.done:
+            return None
+        for item in iterator:
+            data = self.feed(item)
+            if data or self.done:
+                return data
+        return self.close()
+
+    def _estimate(self, count):
+        """
+        Estimate the size of the output for `count` more items.
+        """
+        return count * self.encoded // self.index if self.index else 0
+
+    async def iterate_async(self, items, executor, offload_threshold):
+        """
+        Like iterate(), for sync or async iterables of items.  With an
+        offload_threshold, items are pulled from sync iterables, and encoded
+        in batches expected to make at least that many bytes, on the executor
+        instead of the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        if not hasattr(items, '__aiter__'):
+            iterator = iter(items)
+            while True:
+                if offload_threshold is None:
+                    data = self._next_chunk(iterator)
+                else:
+                    data = await loop.run_in_executor(executor, self._next_chunk, iterator)
+                if data is None:
+                    return
+                if data:
+                    yield data
+            return
+
+        batch = []
+        async for item in items:
+            batch.append(item)
+            if offload_threshold is None or not self.index:
+                data = self.feed_many(batch)
+            elif self._estimate(len(batch)) >= offload_threshold:
+                data = await loop.run_in_executor(executor, self.feed_many, batch)
+            else:
+                continue
+            batch = []
+            if data:
+                yield data
+            if self.done:
+                return
+
+        if offload_threshold is not None and (self._estimate(len(batch)) >= offload_threshold or self.items):
+            data = await loop.run_in_executor(executor, self.feed_many, batch)
+            data += await loop.run_in_executor(executor, self.close)
+        else:
+            data = self.feed_many(batch) + self.close()
+        if data:
+            yield data
+
+
 class RequireJSON(object):
+    """
+    Rejects requests for which JSONTranslator could not decode the body or
+    encode the response.  Pass the same `formats` as to JSONTranslator to also
+    accept other formats than JSON, and ndjson=True and patches=True if
+    JSONTranslator reads NDJSON request bodies and patches.
+    """
+    def __init__(self, formats=(), ndjson=False, patches=False):
+        self.media_types    = frozenset(codec.media_type for codec in formats)
+        self.ndjson         = ndjson
+        self.patches        = patches
+
     def process_resource(self, req, resp, resource, params):
-        if _get_response_schema(resource, req) and not req.client_accepts_json:
-            raise falcon.HTTPNotAcceptable('This API supports only JSON-encoded responses')
+        route = _resolve_route(resource, req.method)
+        if route.response_schema and not req.client_accepts_json:
+            if not any(req.client_accepts(media_type) for media_type in self.media_types):
+                raise falcon.HTTPNotAcceptable('This API supports only JSON-encoded responses')
         if req.method in ('POST', 'PUT', 'PATCH'):
-            if _get_request_schema(req, resource) is not None:
-                if req.content_type is None or 'application/json' not in req.content_type:
+            if route.request_schema is not None:
+                content_type = req.content_type
+                if content_type is None:
                     raise falcon.HTTPUnsupportedMediaType('This API supports only JSON-encoded requests')
+                media_type = _media_type(content_type)
+                if self.ndjson and media_type == ndjson.MEDIA_TYPE:
+                    return
+                if self.patches and req.method == 'PATCH' and media_type in patch.MEDIA_TYPES:
+                    return
+                if 'application/json' not in content_type and media_type not in self.media_types:
+                    raise falcon.HTTPUnsupportedMediaType('This API supports only JSON-encoded requests')
+
+    async def process_resource_async(self, req, resp, resource, params):
+        self.process_resource(req, resp, resource, params)
 
 class JSONTranslator(object):
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, codec=None, max_body_size=None, chunk_size=64 * 1024, response_validation=None,
+                 validation_cache_size=0, validation_cache_ttl=None, offload_threshold=None, executor=None, metrics=None,
+                 error_mode='full', max_errors=10, parallel_threshold=None, parallel_executor=None, parallel_chunk_size=1000,
+                 formats=(), compression_threshold=None, encodings=None, max_decompressed_size=None, etags=False,
+                 response_cache_size=0, response_cache_ttl=None, fields_param=None, schema_encoding=False, ndjson=None, patches=False,
+                 max_line_size=None):
         if logger is None:
             # Default to no logging if no logger provided
             logger = logging.getLogger(__name__)
             logger.addHandler(_null_handler())
-        self.logger = logger
+        if codec is None:
+            codec = StdlibCodec()
+        if response_validation is None:
+            response_validation = Always()
+        if encodings is None:
+            encodings = compression.available_encodings()
+        if max_decompressed_size is None:
+            # Never decompress without a limit, or a small body could expand
+            # to fill the memory
+            max_decompressed_size = max_body_size if max_body_size is not None else compression.DEFAULT_MAX_DECOMPRESSED_SIZE
+        if error_mode not in ('full', 'first', 'all'):
+            raise ValueError("error_mode must be one of 'full', 'first' or 'all'")
+        if ndjson not in (None, 'reject', 'skip'):
+            raise ValueError("ndjson must be None, 'reject' or 'skip'")
+        self.logger                 = logger
+        self.codec                  = codec
+        self.max_body_size          = max_body_size
+        self.chunk_size             = chunk_size
+        self.response_validation    = response_validation
+        self.validation_cache       = LRUCache(validation_cache_size, validation_cache_ttl) if validation_cache_size else None
+        self.offload_threshold      = offload_threshold
+        self.executor               = executor
+        self.metrics                = metrics
+        self.error_mode             = error_mode
+        self.max_errors             = max_errors
+        self.parallel_threshold     = parallel_threshold
+        self.parallel_executor      = parallel_executor
+        self.parallel_chunk_size    = parallel_chunk_size
+        self.formats                = dict((codec.media_type, codec) for codec in formats)
+        # Ties in the Accept header go to the last media type, i.e. to JSON
+        self._response_media_types  = [codec.media_type for codec in formats] + ['application/json']
+        self.compression_threshold  = compression_threshold
+        self.encodings              = encodings
+        self._encodings_by_name     = dict((encoding.name, encoding) for encoding in encodings)
+        self.max_decompressed_size  = max_decompressed_size
+        self.etags                  = etags
+        self.response_cache         = LRUCache(response_cache_size, response_cache_ttl) if response_cache_size else None
+        self.fields_param           = fields_param
+        self.schema_encoding        = schema_encoding
+        self.ndjson                 = ndjson
+        self.patches                = patches
+        self.max_line_size          = max_line_size
+        self._lock                  = threading.Lock()
+
+    def _timer(self, route, metric):
+        if self.metrics is None:
+            return NULL_TIMER
+        return Timer(self.metrics, route.resource_name, route.responder, metric)
+
+    def _observe(self, route, metric, value):
+        if self.metrics is not None:
+            self.metrics.observe(route.resource_name, route.responder, metric, value)
+
+    def _body_too_large(self, limit=None):
+        return _HTTPPayloadTooLarge(
+            'Request body too large',
+            'The request body must not exceed {0} bytes'.format(limit if limit is not None else self.max_body_size)
+        )
+
+    def _read_body(self, req):
+        length = req.content_length
+        if length is not None:
+            # Reject on the declared size before reading anything, and never
+            # read past it
+            if self.max_body_size is not None and length > self.max_body_size:
+                raise self._body_too_large()
+            return req.stream.read(length)
+
+        body = bytearray()
+        while True:
+            chunk = req.stream.read(self.chunk_size)
+            if not chunk:
+                break
+            body += chunk
+            if self.max_body_size is not None and len(body) > self.max_body_size:
+                raise self._body_too_large()
+        # Codecs take the buffer as it is, saving a copy of the whole body
+        return body
+
+    async def _read_body_async(self, req):
+        length = req.content_length
+        if length is not None:
+            if self.max_body_size is not None and length > self.max_body_size:
+                raise self._body_too_large()
+            return await req.stream.read(length)
+
+        body = bytearray()
+        async for chunk in req.stream:
+            body += chunk
+            if self.max_body_size is not None and len(body) > self.max_body_size:
+                raise self._body_too_large()
+        # Codecs take the buffer as it is, saving a copy of the whole body
+        return body
+
+    def _decompress_body(self, req, body):
+        content_encoding = req.get_header('Content-Encoding')
+        if not content_encoding:
+            return body
+
+        # Codings are listed in the order they were applied
+        for name in reversed(content_encoding.split(',')):
+            name = name.strip().lower()
+            if name in ('', 'identity'):
+                continue
+            encoding = self._encodings_by_name.get(name)
+            if encoding is None:
+                raise falcon.HTTPUnsupportedMediaType('This API does not support the {0} content encoding'.format(name))
+            try:
+                body = compression.decompress(encoding, body, self.max_decompressed_size, self.chunk_size)
+            except compression.DecompressionError as error:
+                raise falcon.HTTPBadRequest(
+                    'Malformed request body',
+                    'Could not decompress the request body as {0}'.format(name)
+                )
+            if body is None:
+                raise self._body_too_large(self.max_decompressed_size)
+        return body
+
+    def _request_codec(self, req, resource):
+        """
+        The codec to decode the request body with, or None if it is not to be
+        decoded.
+        """
+        if resource is None or req.method not in ('POST', 'PUT', 'PATCH') or req.content_type is None:
+            return None
+        if 'application/json' in req.content_type or self._patch_media_type(req) is not None:
+            return self.codec
+        if self.formats:
+            return self.formats.get(_media_type(req.content_type))
+        return None
+
+    def _is_ndjson(self, req, resource):
+        """
+        Whether the request body is NDJSON to hand to the responder record by
+        record.
+        """
+        if self.ndjson is None or resource is None or req.method not in ('POST', 'PUT', 'PATCH') or req.content_type is None:
+            return False
+        if _media_type(req.content_type) != ndjson.MEDIA_TYPE:
+            return False
+        # Records are decoded as they are read, which leaves no room for
+        # decompressing the body first
+        if req.get_header('Content-Encoding') not in (None, '', 'identity'):
+            raise falcon.HTTPUnsupportedMediaType('This API does not support compressed NDJSON request bodies')
+        length = req.content_length
+        if self.max_body_size is not None and length is not None and length > self.max_body_size:
+            raise self._body_too_large()
+        return True
+
+    def _ndjson_record(self, number, line, validator, skipped):
+        """
+        Decode and validate one line of an NDJSON body, returning _SKIPPED if
+        it is to be skipped.
+        """
+        try:
+            record = self.codec.loads(line)
+        except (ValueError, UnicodeDecodeError) as error:
+            if self.ndjson == 'skip':
+                skipped.append({'line': number, 'reason': 'malformed'})
+                return _SKIPPED
+            raise falcon.HTTPBadRequest(
+                'Malformed JSON',
+                'Could not decode line {0} of the request body.  The JSON was incorrect or not encoded as UTF-8'.format(number)
+            )
+
+        if validator is None:
+            return record
+        if self.ndjson == 'skip':
+            errors = self._request_errors(record, validator)
+            if errors:
+                skipped.append({'line': number, 'reason': 'invalid', 'errors': [_error_summary(error) for error in errors]})
+                return _SKIPPED
+        else:
+            self._validate_request(record, validator, number)
+        return record
+
+    def _line_too_long(self, error):
+        return _HTTPPayloadTooLarge('Request body line too large', str(error))
+
+    def _ndjson_records(self, lines, validator, skipped):
+        try:
+            for number, line in lines:
+                record = self._ndjson_record(number, line, validator, skipped)
+                if record is not _SKIPPED:
+                    yield record
+        except ndjson.LineTooLong as error:
+            raise self._line_too_long(error)
+        except ndjson.BodyTooLarge:
+            raise self._body_too_large()
+
+    async def _ndjson_records_async(self, lines, validator, skipped):
+        try:
+            async for number, line in lines:
+                record = self._ndjson_record(number, line, validator, skipped)
+                if record is not _SKIPPED:
+                    yield record
+        except ndjson.LineTooLong as error:
+            raise self._line_too_long(error)
+        except ndjson.BodyTooLarge:
+            raise self._body_too_large()
+
+    def _response_encoding(self, req, resp):
+        if self.compression_threshold is None or resp.get_header('Content-Encoding'):
+            return None
+        resp.append_header('Vary', 'Accept-Encoding')
+        encoding = compression.choose_encoding(req.get_header('Accept-Encoding'), self.encodings)
+        if encoding is not None:
+            resp.set_header('Content-Encoding', encoding.name)
+            etag = resp.get_header('ETag')
+            if etag is not None:
+                resp.set_header('ETag', _encoded_etag(etag, encoding))
+        return encoding
+
+    def _negotiate_codec(self, req):
+        if not self.formats:
+            return self.codec
+        return self.formats.get(req.client_prefers(self._response_media_types)) or self.codec
+
+    def _response_codec(self, req, resp):
+        if not self.formats:
+            return self.codec
+        resp.append_header('Vary', 'Accept')
+        codec = self._negotiate_codec(req)
+        if codec is not self.codec:
+            resp.content_type = codec.media_type
+        return codec
+
+    def _check_etag(self, req, resource, params):
+        """
+        Answer with 304 if the client already has the version of the document
+        identified by the resource's etag key, or set that ETag.
+        """
+        route = _resolve_route(resource, req.method)
+        if route.etag is None:
+            return None
+        key = route.etag(resource, req, params)
+        if key is None:
+            return None
+
+        codec = self._negotiate_codec(req)
+        etag = '{0}'.format(key) if codec is self.codec else '{0}-{1}'.format(key, codec.name)
+        fields = req.context.get('fields')
+        if fields is not None:
+            etag += '-' + hashlib.blake2b(','.join(sorted(fields)).encode('utf-8'), digest_size=4).hexdigest()
+        etag = '"{0}"'.format(etag)
+        if _etag_matches(req.get_header('If-None-Match'), etag, self.encodings):
+            raise falcon.HTTPStatus(falcon.HTTP_304, {'ETag': etag})
+        return etag
+
+    def invalidate(self, resource, params=None):
+        """
+        Drop the cached responses of a resource instance, or of every instance
+        of a resource class, or only those for the given route parameters.
+        """
+        if self.response_cache is None:
+            return
+        if isinstance(resource, type):
+            matches = lambda key: issubclass(key[1], resource)
+        else:
+            matches = lambda key: key[0] == id(resource)
+        if params is not None:
+            params = tuple(sorted(params.items()))
+        self.response_cache.discard(lambda key: matches(key) and (params is None or key[3] == params))
+
+    def _check_response_cache(self, req, resource, params):
+        """
+        Answer from the response cache, if the responder's result is there.
+        """
+        route = _resolve_route(resource, req.method)
+        if route.response_cache is None:
+            return
+        # Entries are per resource instance, as several routes may be served
+        # by instances of the same class; each entry holds on to its instance
+        # so that the id stays unique
+        key = (id(resource), resource.__class__, self._negotiate_codec(req).name, tuple(sorted(params.items())), route.response_cache.cache_key(req, params), req.context.get('fields'))
+        entry = self.response_cache.get(key)
+        if entry is None or entry[0] is not resource:
+            req.context['response_cache_key'] = (key, resource)
+            return
+        # Skip the responder; process_response sends the data
+        req.context['cached_response'] = entry[1:]
+        raise falcon.HTTPStatus(falcon.HTTP_200)
+
+    def _parse_fields(self, req, resource):
+        """
+        Check the fields requested for a responder with a response schema.
+        """
+        route = _resolve_route(resource, req.method)
+        values = req.get_param_as_list(self.fields_param)
+        if not values or route.response_schema is None:
+            return None
+        # Falcon 3 no longer splits comma-separated values itself
+        fields = [name for value in values for name in value.split(',') if name]
+
+        schema = _object_schema(route.response_schema.schema)
+        properties = schema.get('properties') if '$ref' not in schema else None
+        if not isinstance(properties, dict):
+            raise falcon.HTTPBadRequest('Invalid fields', 'This resource does not support selecting fields')
+        unknown = [name for name in fields if name not in properties]
+        if unknown:
+            raise falcon.HTTPBadRequest('Invalid fields', 'Unknown fields: {0}'.format(', '.join(unknown)))
+        return frozenset(fields)
+
+    def _get_resource(self, req, resp, resource, params):
+        """
+        Handle what comes before the responder of a GET request, which may
+        raise HTTPStatus to skip it.
+        """
+        if self.fields_param is not None:
+            fields = self._parse_fields(req, resource)
+            if fields is not None:
+                req.context['fields'] = fields
+        etag = self._check_etag(req, resource, params)
+        if etag is not None:
+            resp.set_header('ETag', etag)
+        if self.response_cache is not None:
+            self._check_response_cache(req, resource, params)
 
     def process_resource(self, req, resp, resource, params):
-        if resource is None or req.method not in ['POST', 'PUT', 'PATCH']:
+        if self.response_cache is not None:
+            req.context['invalidate'] = self.invalidate
+        if req.method == 'GET' and resource is not None:
+            self._get_resource(req, resp, resource, params)
+
+        if self._is_ndjson(req, resource):
+            validator = _get_record_validator(_resolve_route(resource, req.method).request_schema)
+            lines = ndjson.iter_lines(req.bounded_stream, self.chunk_size, self.max_line_size, self.max_body_size)
+            skipped = req.context['skipped_records'] = []
+            req.context['doc'] = self._ndjson_records(lines, validator, skipped)
+            return
+
+        codec = self._request_codec(req, resource)
+        if codec is None:
+            return
+
+        route = _resolve_route(resource, req.method)
+        with self._timer(route, metrics.READ):
+            body = self._read_body(req)
+            size = len(body)
+            body = self._decompress_body(req, body)
+        self._observe(route, metrics.REQUEST_SIZE, size)
+        req.context['doc'] = self._load_request(req, body, route, codec)
+
+    async def process_resource_async(self, req, resp, resource, params):
+        if self.response_cache is not None:
+            req.context['invalidate'] = self.invalidate
+        if req.method == 'GET' and resource is not None:
+            self._get_resource(req, resp, resource, params)
+
+        if self._is_ndjson(req, resource):
+            validator = _get_record_validator(_resolve_route(resource, req.method).request_schema)
+            lines = ndjson.iter_lines_async(req.stream, self.max_line_size, self.max_body_size)
+            skipped = req.context['skipped_records'] = []
+            req.context['doc'] = self._ndjson_records_async(lines, validator, skipped)
             return
 
-        if 'application/json' in req.content_type:
-            body = req.stream.read()
-            if not body:
+        codec = self._request_codec(req, resource)
+        if codec is None:
+            return
+
+        route = _resolve_route(resource, req.method)
+        with self._timer(route, metrics.READ):
+            body = await self._read_body_async(req)
+            size = len(body)
+            body = self._decompress_body(req, body)
+        self._observe(route, metrics.REQUEST_SIZE, size)
+        if self.offload_threshold is not None and len(body) >= self.offload_threshold:
+            # Keep decoding and validating large bodies off the event loop
+            loop = asyncio.get_running_loop()
+            req.context['doc'] = await loop.run_in_executor(self.executor, self._load_request, req, body, route, codec)
+        else:
+            req.context['doc'] = self._load_request(req, body, route, codec)
+
+    def _decode_and_validate(self, body, route, codec):
+        try:
+            with self._timer(route, metrics.DECODE):
+                doc = codec.loads(body)
+        except (ValueError, UnicodeDecodeError) as error:
+            if codec is not self.codec:
                 raise falcon.HTTPBadRequest(
-                    'Empty request body',
-                    'A valid JSON document is required'
+                    'Malformed request body',
+                    'Could not decode the request body as {0}'.format(codec.media_type)
                 )
+            raise falcon.HTTPBadRequest(
+                'Malformed JSON',
+                'Could not decode the request body.  The JSON was incorrect or not encoded as UTF-8'
+            )
 
-            schema = _get_request_schema(req, resource)
-            try:
-                req.context['doc'] = json.loads(body.decode('utf-8'))
-            except (ValueError, UnicodeDecodeError) as error:
-                if schema is not None:
-                    raise falcon.HTTPBadRequest(
-                        'Malformed JSON',
-                        'Could not decode the request body.  The JSON was incorrect or not encoded as UTF-8'
-                    )
-                req.context['doc'] = body
-
-            if schema is not None:
-                try:
-                    schema.validate(req.context['doc'])
-                except jsonschema.exceptions.ValidationError as error:
-                    raise falcon.HTTPBadRequest(
-                        'Invalid request body',
-                        json.dumps({'error': str(error)})
-                    )
-
-    def process_response(self, req, resp, resource):
-        if 'result' not in req.context:
+        with self._timer(route, metrics.VALIDATE):
+            self._validate_request(doc, route.request_schema)
+        return doc
+
+    def _get_parallel_executor(self):
+        if self.parallel_executor is None:
+            with self._lock:
+                if self.parallel_executor is None:
+                    self.parallel_executor = parallel.default_executor()
+        return self.parallel_executor
+
+    def _iter_request_errors(self, doc, schema, limit):
+        if self.parallel_threshold is not None and isinstance(doc, list) and len(doc) >= self.parallel_threshold:
+            validators = _get_array_validators(schema)
+            if validators is not None:
+                executor = self._get_parallel_executor()
+                if parallel.supports(executor, validators[1]):
+                    return parallel.iter_errors(executor, validators[0], validators[1], doc, self.parallel_chunk_size, limit)
+        return schema.iter_errors(doc)
+
+    def _request_errors(self, doc, schema):
+        limit = self.max_errors if self.error_mode == 'all' else 1
+        found = self._iter_request_errors(doc, schema, limit)
+        try:
+            return list(itertools.islice(found, limit))
+        finally:
+            if hasattr(found, 'close'):
+                found.close()
+
+    def _validate_request(self, doc, schema, line=None, path=()):
+        errors = self._request_errors(doc, schema)
+        if not errors:
             return
+        for error in errors:
+            error.path.extendleft(reversed(path))
+        if self.error_mode == 'full':
+            error = {'error': str(errors[0])}
+            if line is not None:
+                error['line'] = line
+            raise _BadRequest(
+                'Invalid request body',
+                json.dumps(error)
+            )
+        # Never render errors with str(), which dumps the schema and instance
+        raise _BadRequest(
+            'Invalid request body',
+            'The request body does not match the schema' if line is None else 'Line {0} of the request body does not match the schema'.format(line),
+            [_error_summary(error) for error in errors]
+        )
 
-        resp.body = json.dumps(req.context['result'])
+    def _patch_media_type(self, req):
+        """
+        The media type of the request body if it is a patch to be parsed.
+        """
+        if not self.patches or req.method != 'PATCH' or req.content_type is None:
+            return None
+        media_type = _media_type(req.content_type)
+        return media_type if media_type in patch.MEDIA_TYPES else None
 
-        schema = _get_response_schema(resource, req)
+    def _validate_patch(self, parsed, schema):
+        """
+        Validate the values a patch sets against the sub-schemas for their
+        paths only, so that the cost of validation follows the size of the
+        change rather than of the document.
+        """
+        resolve = _resolver(schema)
+        for change, path, value in parsed.changes():
+            if change == 'set':
+                validator = _get_patch_validator(schema, path)
+                if validator is None:
+                    raise self._invalid_patch('The schema does not allow {0}', path)
+                self._validate_request(value, validator, path=path)
+            elif change == 'object':
+                target = patch.schema_at(schema.schema, path, resolve)
+                if target is None:
+                    raise self._invalid_patch('The schema does not allow {0}', path)
+                if not patch.admits_object(target, resolve):
+                    raise self._invalid_patch('The schema does not allow an object at {0}', path)
+            elif change == 'copy':
+                # The value is only known to match the schema of where it
+                # comes from, so that must be the schema of where it goes
+                target = patch.schema_at(schema.schema, path, resolve)
+                if target is None:
+                    raise self._invalid_patch('The schema does not allow {0}', path)
+                if target and target != patch.schema_at(schema.schema, value, resolve):
+                    raise self._invalid_patch('Cannot move or copy {1} to {0}, whose schema differs', path, value)
+            elif path and path[-1] in patch.required(patch.schema_at(schema.schema, path[:-1], resolve), resolve):
+                raise self._invalid_patch('Cannot remove required member {0}', path)
+
+    def _invalid_patch(self, description, path, from_path=()):
+        return falcon.HTTPBadRequest('Invalid patch', description.format(patch.format_pointer(path), patch.format_pointer(from_path)))
+
+    def _load_patch(self, body, route, media_type):
+        if not body:
+            raise falcon.HTTPBadRequest(
+                'Empty request body',
+                'A valid JSON document is required'
+            )
+        try:
+            with self._timer(route, metrics.DECODE):
+                parsed = patch.parse(media_type, self.codec.loads(body))
+        except patch.PatchError as error:
+            raise falcon.HTTPBadRequest('Malformed patch', str(error))
+        except (ValueError, UnicodeDecodeError) as error:
+            raise falcon.HTTPBadRequest(
+                'Malformed JSON',
+                'Could not decode the request body.  The JSON was incorrect or not encoded as UTF-8'
+            )
+
+        if route.request_schema is not None:
+            with self._timer(route, metrics.VALIDATE):
+                self._validate_patch(parsed, route.request_schema)
+        return parsed
+
+    def _load_request(self, req, body, route, codec):
+        """
+        Decode and validate a request body; patches are also made available
+        parsed as req.context['patch'].
+        """
+        media_type = self._patch_media_type(req)
+        if media_type is None:
+            return self._load(body, route, codec)
+        parsed = req.context['patch'] = self._load_patch(body, route, media_type)
+        return parsed.document
+
+    def _load(self, body, route, codec):
+        if not body:
+            raise falcon.HTTPBadRequest(
+                'Empty request body',
+                'A valid JSON document is required'
+            )
+
+        schema = route.request_schema
         if schema is None:
-            return
+            try:
+                with self._timer(route, metrics.DECODE):
+                    return codec.loads(body)
+            except (ValueError, UnicodeDecodeError) as error:
+                return bytes(body)
 
+        if self.validation_cache is None:
+            return self._decode_and_validate(body, route, codec)
+
+        # Only the verdict is cached: handing every request a freshly decoded
+        # document is cheaper than deep copying a cached one to keep it safe
+        # from handlers modifying it
+        key = (id(schema), codec.media_type, hashlib.blake2b(body, digest_size=16).digest())
+        verdict = self.validation_cache.get(key)
+        if verdict is _VALID:
+            with self._timer(route, metrics.DECODE):
+                return codec.loads(body)
+        if verdict is not None:
+            raise _BadRequest(*verdict)
+
+        try:
+            doc = self._decode_and_validate(body, route, codec)
+        except falcon.HTTPBadRequest as error:
+            self.validation_cache.set(key, (error.title, error.description, getattr(error, 'errors', None)))
+            raise
+        self.validation_cache.set(key, _VALID)
+        return doc
+
+    def _validate_response(self, route, validator, policy, instance, description='it'):
+        """
+        Validate (part of) a response, returning False if it is to be blocked.
+        """
+        start = time.perf_counter()
         try:
-            schema.validate(req.context['result'])
+            validator.validate(instance)
         except jsonschema.exceptions.ValidationError as error:
-            method_name = {'POST': 'on_post', 'PUT': 'on_put', 'PATCH': 'on_patch', 'GET': 'on_get', 'DELETE': 'on_delete'}[req.method]
-            self.logger.error('Blocking proposed response from being sent from {0}.{1}.{2} to client as it does not match the defined schema: {3}'.format(resource.__module__, resource.__class__.__name__, method_name, str(error)))
+            if policy.block:
+                self.logger.error('Blocking proposed response from being sent from {0}.{1} to client as {2} does not match the defined schema: {3}'.format(route.resource_name, route.responder, description, str(error)))
+                return False
+            self.logger.error('Sending response from {0}.{1} to client although {2} does not match the defined schema: {3}'.format(route.resource_name, route.responder, description, str(error)))
+        finally:
+            elapsed = time.perf_counter() - start
+            policy.record(elapsed)
+            self._observe(route, metrics.VALIDATE_RESPONSE, elapsed)
+        return True
+
+    def _not_modified(self, req, resp):
+        """
+        Answer with 304 (returning True) if the client already has the encoded
+        document in resp.data.
+        """
+        if req.method != 'GET' or resp.status not in (falcon.HTTP_200, 200):
+            return False
+        etag = resp.get_header('ETag')
+        if etag is None and self.etags:
+            etag = '"{0}"'.format(hashlib.blake2b(resp.data, digest_size=16).hexdigest())
+            resp.set_header('ETag', etag)
+        if etag is None or not _etag_matches(req.get_header('If-None-Match'), etag, self.encodings):
+            return False
+        resp.status = falcon.HTTP_304
+        resp.data = None
+        return True
+
+    def _compress_data(self, req, resp):
+        if self.compression_threshold is not None and len(resp.data) >= self.compression_threshold:
+            encoding = self._response_encoding(req, resp)
+            if encoding is not None:
+                compressor = encoding.compressor()
+                resp.data = compressor.compress(resp.data) + compressor.flush()
+
+    def process_response(self, req, resp, resource, req_succeeded=True):
+        stream = self._process_response(req, resp, resource)
+        if stream is not None:
+            resp.stream = stream.iterate(req.context['result_stream'])
+
+    def _process_response(self, req, resp, resource):
+        """
+        Encode the result into resp.data, or return a _StreamEncoder for a
+        streamed result.
+        """
+        if 'cached_response' in req.context:
+            data, headers = req.context['cached_response']
+            for name, value in headers.items():
+                resp.set_header(name, value)
+            self._response_codec(req, resp)
+            resp.data = data
+            if not self._not_modified(req, resp):
+                self._compress_data(req, resp)
+            return
+
+        if 'result_stream' not in req.context and 'result' not in req.context:
+            return
+
+        route = _resolve_route(resource, req.method)
+        policy = route.response_validation or self.response_validation
+        schema = route.response_schema
+
+        # Only set for responders with a response schema
+        fields = req.context.get('fields')
+        if fields is not None:
+            schema = _get_projected_validator(schema, fields)
+        validator = schema if schema is not None and policy.should_validate() else None
+
+        codec = self._response_codec(req, resp)
+        if 'result_stream' in req.context:
+            items_validator = array_validator = None
+            if validator is not None:
+                items_validator, array_validator = _get_stream_validators(validator)
+            # The size of a stream is unknown up front, so streams are always
+            # compressed, a chunk at a time
+            encoding = self._response_encoding(req, resp)
+            return _StreamEncoder(self, route, codec, items_validator, array_validator, policy, fields, encoding.compressor() if encoding is not None else None)
+
+        result = req.context['result']
+        if fields is not None:
+            result = _project(result, fields)
+        encoder = _get_encoder(schema) if self.schema_encoding and schema is not None and codec is self.codec else None
+        with self._timer(route, metrics.ENCODE):
+            data = None
+            if encoder is not None:
+                # Check and encode at once; invalid results take the usual
+                # way, which also reports their errors
+                data = encoder.encode(result)
+                if data is not None:
+                    validator = None
+                else:
+                    result = to_plain(result)
+            if data is None:
+                data = codec.dumps(result)
+        resp.data = data
+        self._observe(route, metrics.RESPONSE_SIZE, len(resp.data))
+
+        # The client has this document already, and had it validated
+        if self._not_modified(req, resp):
+            return
+
+        if validator is not None and not self._validate_response(route, validator, policy, result):
             raise falcon.HTTPInternalServerError('Internal Server Error', 'Undisclosed')
+
+        if 'response_cache_key' in req.context and resp.status in (falcon.HTTP_200, 200):
+            key, resource = req.context['response_cache_key']
+            self.response_cache.set(key, (resource, resp.data, _cacheable_headers(resp)), route.response_cache.ttl)
+
+        self._compress_data(req, resp)
+
+    async def process_response_async(self, req, resp, resource, req_succeeded):
+        stream = self._process_response(req, resp, resource)
+        if stream is not None:
+            resp.stream = stream.iterate_async(req.context['result_stream'], self.executor, self.offload_threshold)
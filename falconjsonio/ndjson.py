@@ -0,0 +1,88 @@
+MEDIA_TYPE = 'application/x-ndjson'
+
+
+class LineTooLong(ValueError):
+    pass
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+class LineSplitter(object):
+    """
+    Splits a newline delimited body, fed in chunks of any size, into its
+    lines.  Lines are numbered from 1; blank lines are counted but not
+    returned.  Lines longer than max_line_size raise LineTooLong, and bodies
+    longer than max_size BodyTooLarge.
+    """
+    def __init__(self, max_line_size=None, max_size=None):
+        self.max_line_size  = max_line_size
+        self.max_size       = max_size
+        self.buffer         = bytearray()
+        self.number         = 0
+        self.size           = 0
+
+    def _lines(self, data):
+        lines = []
+        for line in data.split(b'\n'):
+            self.number += 1
+            if self.max_line_size is not None and len(line) > self.max_line_size:
+                raise LineTooLong('Line {0} is longer than {1} bytes'.format(self.number, self.max_line_size))
+            line = line.strip()
+            if line:
+                lines.append((self.number, bytes(line)))
+        return lines
+
+    def feed(self, chunk):
+        """
+        Return the (number, line) pairs completed by a chunk.
+        """
+        self.size += len(chunk)
+        if self.max_size is not None and self.size > self.max_size:
+            raise BodyTooLarge('The body is longer than {0} bytes'.format(self.max_size))
+        self.buffer += chunk
+        end = self.buffer.rfind(b'\n')
+        if end < 0:
+            lines = []
+        else:
+            lines = self._lines(self.buffer[:end])
+            del self.buffer[:end + 1]
+        if self.max_line_size is not None and len(self.buffer) > self.max_line_size:
+            raise LineTooLong('Line {0} is longer than {1} bytes'.format(self.number + 1, self.max_line_size))
+        return lines
+
+    def close(self):
+        """
+        Return the last line, if the body does not end with a newline.
+        """
+        lines = self._lines(self.buffer) if self.buffer.strip() else []
+        del self.buffer[:]
+        return lines
+
+
+def iter_lines(stream, chunk_size, max_line_size=None, max_size=None):
+    """
+    Yield the numbered lines of a newline delimited body read from a file-like
+    stream.
+    """
+    splitter = LineSplitter(max_line_size, max_size)
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        for line in splitter.feed(chunk):
+            yield line
+    for line in splitter.close():
+        yield line
+
+async def iter_lines_async(stream, max_line_size=None, max_size=None):
+    """
+    Like iter_lines(), for a stream yielding chunks asynchronously.
+    """
+    splitter = LineSplitter(max_line_size, max_size)
+    async for chunk in stream:
+        for line in splitter.feed(chunk):
+            yield line
+    for line in splitter.close():
+        yield line
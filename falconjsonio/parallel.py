@@ -0,0 +1,131 @@
+from falconjsonio.compiler import CompiledValidator, UnsupportedSchema
+
+import concurrent.futures
+import json
+import jsonschema.validators
+import pickle
+import sys
+
+
+def default_executor():
+    """
+    A thread pool on free-threaded Python builds, where threads validate in
+    parallel, and a process pool everywhere else.
+    """
+    if not getattr(sys, '_is_gil_enabled', lambda: True)():
+        return concurrent.futures.ThreadPoolExecutor()
+    return concurrent.futures.ProcessPoolExecutor()
+
+
+class _ValidatorRecipe(object):
+    """
+    Picklable description of an items validator, rebuilt (once) in each worker
+    process.
+    """
+    def __init__(self, validator):
+        self.compiled = isinstance(validator, CompiledValidator)
+        if self.compiled:
+            validator = validator.validator
+        # Validator classes made by jsonschema.validators.create() cannot be
+        # pickled, so they are looked up again by their meta-schema
+        self.meta_schema    = _meta_schema_id(validator.__class__)
+        self.schema         = validator.schema
+        self.format_checker = validator.format_checker
+        self.key            = (self.meta_schema, json.dumps(self.schema, sort_keys=True), self.compiled)
+
+def _meta_schema_id(validator_cls):
+    meta_schema = getattr(validator_cls, 'META_SCHEMA', {})
+    return meta_schema.get('$id', meta_schema.get('id'))
+
+def _validator_cls(meta_schema):
+    return jsonschema.validators.validator_for({'$schema': meta_schema}, default=None)
+
+# Validators built from recipes in this (worker) process
+_worker_validators = {}
+
+
+def _build(recipe):
+    try:
+        return _worker_validators[recipe.key]
+    except KeyError:
+        pass
+
+    validator = _validator_cls(recipe.meta_schema)(recipe.schema, format_checker=recipe.format_checker)
+    if recipe.compiled:
+        try:
+            validator = CompiledValidator(validator)
+        except UnsupportedSchema:
+            pass
+    return _worker_validators.setdefault(recipe.key, validator)
+
+def _invalid_items(validator, start, items, limit):
+    """
+    Return the indices of up to `limit` invalid items, counting from `start`.
+    """
+    if isinstance(validator, _ValidatorRecipe):
+        validator = _build(validator)
+
+    invalid = []
+    for index, item in enumerate(items, start):
+        if not validator.is_valid(item):
+            invalid.append(index)
+            if len(invalid) >= limit:
+                break
+    return invalid
+
+
+def supports(executor, items_validator):
+    """
+    Whether items can be validated on an executor: validators rebuilt in worker
+    processes have no resolver to follow references with, and must be of a
+    validator class registered for its meta-schema.
+    """
+    if not isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+        return True
+    if '"$ref"' in json.dumps(items_validator.schema):
+        return False
+    recipe = _ValidatorRecipe(items_validator)
+    validator = items_validator.validator if recipe.compiled else items_validator
+    if _validator_cls(recipe.meta_schema) is not validator.__class__:
+        return False
+    try:
+        pickle.dumps(recipe)
+    except Exception:
+        return False
+    return True
+
+def iter_errors(executor, array_validator, items_validator, instance, chunk_size, limit):
+    """
+    Validate the items of an array in chunks across an executor, yielding
+    errors like a jsonschema validator would: first those for the array itself
+    (against `array_validator`, which may be None), then those for the items in
+    index order.
+
+    Only the indices of invalid items are sent back from the workers; their
+    errors are then produced locally.
+    """
+    if array_validator is not None:
+        for error in array_validator.iter_errors(instance):
+            yield error
+
+    if isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+        worker_validator = _ValidatorRecipe(items_validator)
+    else:
+        worker_validator = items_validator
+
+    futures = [
+        executor.submit(_invalid_items, worker_validator, start, instance[start:start + chunk_size], limit)
+        for start in range(0, len(instance), chunk_size)
+    ]
+    try:
+        for future in futures:
+            for index in future.result():
+                for error in items_validator.iter_errors(instance[index]):
+                    error.path.appendleft(index)
+                    error.schema_path.appendleft('items')
+                    yield error
+    finally:
+        # Stop early once the caller has seen enough errors
+        for future in futures:
+            future.cancel()
+
@@ -0,0 +1,345 @@
+import collections
+import copy
+import re
+
+
+MERGE_PATCH = 'application/merge-patch+json'
+JSON_PATCH  = 'application/json-patch+json'
+MEDIA_TYPES = frozenset([MERGE_PATCH, JSON_PATCH])
+
+_JSON_PATCH_OPS = {
+    'add':      ('value',),
+    'remove':   (),
+    'replace':  ('value',),
+    'move':     ('from',),
+    'copy':     ('from',),
+    'test':     ('value',),
+}
+
+
+class PatchError(ValueError):
+    pass
+
+
+Operation = collections.namedtuple('Operation', ['op', 'path', 'value', 'from_path'])
+
+
+def parse_pointer(pointer):
+    """
+    Split a JSON pointer (RFC 6901) into its reference tokens.
+    """
+    if not isinstance(pointer, str) or (pointer and not pointer.startswith('/')):
+        raise PatchError('Invalid JSON pointer: {0!r}'.format(pointer))
+    if not pointer:
+        return ()
+    return tuple(token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/'))
+
+def format_pointer(path):
+    return ''.join('/' + str(token).replace('~', '~0').replace('/', '~1') for token in path)
+
+
+class Patch(object):
+    """
+    A parsed merge patch (RFC 7386) or JSON Patch (RFC 6902) document.
+
+    `operations` lists what the patch does as Operations whose paths are
+    tuples of reference tokens.  Those of a merge patch are 'add' for every
+    value set (objects being merged member by member, unless empty) and
+    'remove' for every member removed; apply() follows the merge algorithm
+    itself.
+    """
+    def __init__(self, media_type, document, operations):
+        self.media_type = media_type
+        self.document   = document
+        self.operations = operations
+
+    def changes(self):
+        """
+        Yield ('set', path, value) for every value the patch writes,
+        ('remove', path, None) for every member it takes out of the document,
+        ('object', path, None) for every object a merge patch merges into, and
+        ('copy', path, from_path) for every value moved or copied within the
+        document.
+        """
+        if self.media_type == MERGE_PATCH:
+            if isinstance(self.document, dict):
+                yield 'object', (), None
+                for change in _merge_changes(self.document, ()):
+                    yield change
+            else:
+                yield 'set', (), self.document
+            return
+
+        for operation in self.operations:
+            if operation.op in ('add', 'replace'):
+                yield 'set', operation.path, operation.value
+            elif operation.op == 'remove':
+                yield 'remove', operation.path, None
+            elif operation.op in ('move', 'copy'):
+                if operation.op == 'move':
+                    yield 'remove', operation.from_path, None
+                yield 'copy', operation.path, operation.from_path
+
+    def apply(self, target):
+        """
+        Return a patched copy of a document.
+        """
+        if self.media_type == MERGE_PATCH:
+            return _merge(copy.deepcopy(target), self.document)
+        document = copy.deepcopy(target)
+        for operation in self.operations:
+            document = _apply(document, operation)
+        return document
+
+
+def _merge_operations(document, prefix):
+    operations = []
+    for name, value in document.items():
+        path = prefix + (name,)
+        if value is None:
+            operations.append(Operation('remove', path, None, None))
+        elif isinstance(value, dict) and value:
+            operations.extend(_merge_operations(value, path))
+        else:
+            operations.append(Operation('add', path, value, None))
+    return operations
+
+def _merge_changes(document, prefix):
+    for name, value in document.items():
+        path = prefix + (name,)
+        if value is None:
+            yield 'remove', path, None
+        elif isinstance(value, dict):
+            # Merged into the member, which becomes an object if it is not
+            # one already (so that empty objects change nothing in objects)
+            yield 'object', path, None
+            for change in _merge_changes(value, path):
+                yield change
+        else:
+            yield 'set', path, value
+
+def _json_patch_operation(index, item):
+    if not isinstance(item, dict) or item.get('op') not in _JSON_PATCH_OPS:
+        raise PatchError('Operation {0} is not a JSON Patch operation'.format(index))
+    for member in ('path',) + _JSON_PATCH_OPS[item['op']]:
+        if member not in item:
+            raise PatchError("Operation {0} has no '{1}'".format(index, member))
+    return Operation(
+        item['op'],
+        parse_pointer(item['path']),
+        item.get('value'),
+        parse_pointer(item['from']) if 'from' in item else None,
+    )
+
+def parse(media_type, document):
+    """
+    Parse a decoded patch document of either media type.
+    """
+    if media_type == MERGE_PATCH:
+        operations = _merge_operations(document, ()) if isinstance(document, dict) else [Operation('replace', (), document, None)]
+    elif media_type == JSON_PATCH:
+        if not isinstance(document, list):
+            raise PatchError('A JSON Patch must be an array of operations')
+        operations = [_json_patch_operation(index, item) for index, item in enumerate(document)]
+    else:
+        raise PatchError('Unknown patch media type {0}'.format(media_type))
+    return Patch(media_type, document, operations)
+
+
+def _merge(target, patch):
+    if not isinstance(patch, dict):
+        return patch
+    if not isinstance(target, dict):
+        target = {}
+    for name, value in patch.items():
+        if value is None:
+            target.pop(name, None)
+        else:
+            target[name] = _merge(target.get(name), value)
+    return target
+
+def _index(container, token, appending=False):
+    if appending and token == '-':
+        return len(container)
+    if not re.match(r'^(0|[1-9][0-9]*)$', token):
+        raise PatchError('Invalid array index {0!r}'.format(token))
+    index = int(token)
+    if index > len(container) or (index == len(container) and not appending):
+        raise PatchError('Array index {0} out of range'.format(index))
+    return index
+
+def _resolve(document, path):
+    for token in path:
+        if isinstance(document, list):
+            document = document[_index(document, token)]
+        elif isinstance(document, dict) and token in document:
+            document = document[token]
+        else:
+            raise PatchError('{0} does not exist'.format(format_pointer(path)))
+    return document
+
+def _add(document, path, value):
+    if not path:
+        return value
+    parent = _resolve(document, path[:-1])
+    if isinstance(parent, list):
+        parent.insert(_index(parent, path[-1], appending=True), value)
+    elif isinstance(parent, dict):
+        parent[path[-1]] = value
+    else:
+        raise PatchError('{0} does not exist'.format(format_pointer(path[:-1])))
+    return document
+
+def _remove(document, path):
+    if not path:
+        raise PatchError('Cannot remove the whole document')
+    parent = _resolve(document, path[:-1])
+    if isinstance(parent, list):
+        return parent.pop(_index(parent, path[-1]))
+    if isinstance(parent, dict) and path[-1] in parent:
+        return parent.pop(path[-1])
+    raise PatchError('{0} does not exist'.format(format_pointer(path)))
+
+def _apply(document, operation):
+    if operation.op == 'add':
+        return _add(document, operation.path, copy.deepcopy(operation.value))
+    if operation.op == 'remove':
+        _remove(document, operation.path)
+        return document
+    if operation.op == 'replace':
+        if not operation.path:
+            return copy.deepcopy(operation.value)
+        _remove(document, operation.path)
+        return _add(document, operation.path, copy.deepcopy(operation.value))
+    if operation.op == 'move':
+        if operation.path[:len(operation.from_path)] == operation.from_path and operation.path != operation.from_path:
+            raise PatchError('Cannot move {0} into itself'.format(format_pointer(operation.from_path)))
+        value = _remove(document, operation.from_path) if operation.from_path else document
+        return _add(document, operation.path, value)
+    if operation.op == 'copy':
+        return _add(document, operation.path, copy.deepcopy(_resolve(document, operation.from_path)))
+    # test
+    if _resolve(document, operation.path) != operation.value:
+        raise PatchError('Test of {0} failed'.format(format_pointer(operation.path)))
+    return document
+
+
+def _dereference(schema, resolve):
+    seen = 0
+    while isinstance(schema, dict) and '$ref' in schema:
+        schema = resolve(schema['$ref'])
+        seen += 1
+        if seen > 100:
+            raise PatchError('Too many nested references')
+    if schema is True:
+        return {}
+    if schema is False:
+        return None
+    return schema
+
+def _own_child_schema(schema, token):
+    types = schema.get('type')
+    is_index = token == '-' or token.isdigit()
+    if types == 'array' or (types is None and is_index and 'items' in schema):
+        if not is_index:
+            return None
+        items = schema.get('items', {})
+        if isinstance(items, list):
+            if token != '-' and int(token) < len(items):
+                return items[int(token)]
+            return schema.get('additionalItems', {})
+        return items
+
+    matched = []
+    properties = schema.get('properties', {})
+    if token in properties:
+        matched.append(properties[token])
+    for pattern, pattern_schema in schema.get('patternProperties', {}).items():
+        if re.search(pattern, token):
+            matched.append(pattern_schema)
+    if not matched:
+        return schema.get('additionalProperties', {})
+    return matched[0] if len(matched) == 1 else {'allOf': matched}
+
+def child_schema(schema, token, resolve):
+    """
+    The schema a member (or item) of an instance of `schema` must match, or
+    None if the schema does not allow it.  `resolve` maps a $ref to the schema
+    it references.
+
+    Keywords constraining the instance as a whole (required, minItems, ...)
+    are not taken into account, and alternatives under oneOf are treated like
+    those under anyOf.
+    """
+    schema = _dereference(schema, resolve)
+    if schema is None:
+        return None
+
+    parts = []
+    own = _dereference(_own_child_schema(schema, token), resolve)
+    if own is None:
+        return None
+    if own:
+        parts.append(own)
+    for sub_schema in schema.get('allOf', []):
+        child = child_schema(sub_schema, token, resolve)
+        if child is None:
+            return None
+        if child:
+            parts.append(child)
+    for keyword in ('anyOf', 'oneOf'):
+        if keyword in schema:
+            options = [child for child in (child_schema(sub_schema, token, resolve) for sub_schema in schema[keyword]) if child is not None]
+            if not options:
+                return None
+            if all(options):
+                parts.append({'anyOf': options})
+
+    if not parts:
+        return {}
+    return parts[0] if len(parts) == 1 else {'allOf': parts}
+
+def schema_at(schema, path, resolve):
+    """
+    The schema of the value at a path in instances of `schema`, or None if the
+    schema does not allow that path.
+    """
+    for token in path:
+        schema = child_schema(schema, token, resolve)
+        if schema is None:
+            return None
+    return _dereference(schema, resolve)
+
+def admits_object(schema, resolve):
+    """
+    Whether instances of `schema` may be objects, as far as its type, enum and
+    const keywords (and those of its allOf, anyOf and oneOf sub-schemas) tell.
+    """
+    schema = _dereference(schema, resolve)
+    if schema is None:
+        return False
+    types = schema.get('type')
+    if types is not None and 'object' not in (types if isinstance(types, list) else [types]):
+        return False
+    if 'enum' in schema and not any(isinstance(value, dict) for value in schema['enum']):
+        return False
+    if 'const' in schema and not isinstance(schema['const'], dict):
+        return False
+    if not all(admits_object(sub_schema, resolve) for sub_schema in schema.get('allOf', [])):
+        return False
+    for keyword in ('anyOf', 'oneOf'):
+        if keyword in schema and not any(admits_object(sub_schema, resolve) for sub_schema in schema[keyword]):
+            return False
+    return True
+
+def required(schema, resolve):
+    """
+    The members instances of `schema` must always have.
+    """
+    schema = _dereference(schema, resolve)
+    if not schema:
+        return set()
+    members = set(schema.get('required', []))
+    for sub_schema in schema.get('allOf', []):
+        members |= required(sub_schema, resolve)
+    return members
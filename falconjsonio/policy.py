@@ -0,0 +1,69 @@
+import random
+import threading
+import time
+
+
+class ValidationPolicy(object):
+    """
+    Decides whether a response is validated against its schema, and whether a
+    response that fails validation is blocked (500) or only logged.
+    """
+    def __init__(self, block=True):
+        self.block = block
+
+    def should_validate(self):
+        return True
+
+    def record(self, elapsed):
+        """
+        Called with the time in seconds each validation took.
+        """
+        pass
+
+
+class Always(ValidationPolicy):
+    pass
+
+
+class Never(ValidationPolicy):
+    def should_validate(self):
+        return False
+
+
+class Sample(ValidationPolicy):
+    """
+    Validate a random fraction (0.0 to 1.0) of responses.
+    """
+    def __init__(self, rate, block=True):
+        super(Sample, self).__init__(block)
+        self.rate = rate
+
+    def should_validate(self):
+        return random.random() < self.rate
+
+
+class TimeBudget(ValidationPolicy):
+    """
+    Validate responses until `budget` seconds have been spent validating within
+    the current `interval` seconds, then skip validation until the next
+    interval starts.
+    """
+    def __init__(self, budget, interval=1.0, block=True):
+        super(TimeBudget, self).__init__(block)
+        self.budget         = budget
+        self.interval       = interval
+        self.window_start   = time.monotonic()
+        self.spent          = 0.0
+        self.lock           = threading.Lock()
+
+    def should_validate(self):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.window_start >= self.interval:
+                self.window_start   = now
+                self.spent          = 0.0
+            return self.spent < self.budget
+
+    def record(self, elapsed):
+        with self.lock:
+            self.spent += elapsed
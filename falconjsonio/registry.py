@@ -0,0 +1,149 @@
+from falconjsonio.compiler import CompiledValidator, UnsupportedSchema
+
+import hashlib
+import json
+import jsonschema
+import jsonschema.validators
+import threading
+
+
+class SchemaRegistry(object):
+    """
+    Named schemas that decorator schemas can reference with {'$ref': name},
+    and the validators built for decorators, shared between all decorators
+    whose schema and validator options are identical.
+
+    Register named schemas before decorating anything that references them.
+
+    With lazy=True, decorators using this registry defer checking and building
+    their validators until first use (or until warmup() is called).
+    """
+    def __init__(self, lazy=False):
+        self.lazy       = lazy
+        self.schemas    = {}
+        self.validators = {}
+        self.pending    = []
+        self.lock       = threading.Lock()
+
+    def register(self, name, schema, validator_cls=None):
+        if validator_cls is None:
+            validator_cls = jsonschema.validators.validator_for(schema)
+        validator_cls.check_schema(schema)
+        with self.lock:
+            self.schemas[name] = schema
+
+    def resolver(self, schema):
+        return jsonschema.RefResolver.from_schema(schema, store=self.schemas)
+
+    def _key(self, schema, validator_cls, validator_args, validator_kwargs, compiled):
+        digest = hashlib.sha1(json.dumps(schema, sort_keys=True).encode('utf-8')).hexdigest()
+        return (
+            digest,
+            validator_cls,
+            tuple(id(arg) for arg in validator_args),
+            tuple(sorted((name, id(value)) for name, value in validator_kwargs.items())),
+            compiled,
+        )
+
+    def validator(self, schema, validator_cls=None, validator_args=None, validator_kwargs=None, compiled=False):
+        """
+        Return a (possibly compiled) validator for a schema, reusing the one
+        built earlier for an identical schema and identical options.
+        """
+        if validator_cls is None:
+            validator_cls = jsonschema.validators.validator_for(schema)
+        if validator_args is None:
+            validator_args = []
+        if validator_kwargs is None:
+            validator_kwargs = {}
+
+        key = self._key(schema, validator_cls, validator_args, validator_kwargs, compiled)
+        with self.lock:
+            try:
+                return self.validators[key]
+            except KeyError:
+                pass
+
+        validator_cls.check_schema(schema)
+        if 'resolver' not in validator_kwargs:
+            validator_kwargs = dict(validator_kwargs, resolver=self.resolver(schema))
+        validator = validator_cls(schema, *validator_args, **validator_kwargs)
+        if compiled:
+            try:
+                validator = CompiledValidator(validator)
+            except UnsupportedSchema:
+                # Stay with the interpreted validator for schemas the compiler
+                # cannot translate exactly
+                pass
+
+        with self.lock:
+            return self.validators.setdefault(key, validator)
+
+    def lazy_validator(self, schema, validator_cls=None, validator_args=None, validator_kwargs=None, compiled=False):
+        """
+        Like validator(), but deferring the work until the validator is first
+        used.
+        """
+        validator = LazyValidator(schema, lambda: self.validator(schema, validator_cls, validator_args, validator_kwargs, compiled))
+        with self.lock:
+            self.pending.append(validator)
+        return validator
+
+    def warmup(self):
+        """
+        Build every lazy validator created so far, e.g. in a pre-fork master
+        process so that workers share them.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for validator in pending:
+            validator.get()
+
+
+class LazyValidator(object):
+    """
+    Stand-in for a validator that is only built, once and thread-safely, when
+    first used.
+    """
+    def __init__(self, schema, build):
+        self.schema     = schema
+        self._build     = build
+        self._validator = None
+        self._lock      = threading.Lock()
+
+    def get(self):
+        validator = self._validator
+        if validator is None:
+            with self._lock:
+                if self._validator is None:
+                    self._validator = self._build()
+                validator = self._validator
+        return validator
+
+    def is_valid(self, instance):
+        return self.get().is_valid(instance)
+
+    def validate(self, instance):
+        self.get().validate(instance)
+
+    def iter_errors(self, instance):
+        return self.get().iter_errors(instance)
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+default_registry = SchemaRegistry()
+
+
+def register_schema(name, schema, validator_cls=None):
+    """
+    Register a named schema in the default registry.
+    """
+    default_registry.register(name, schema, validator_cls)
+
+def warmup():
+    """
+    Build every lazy validator of the default registry.
+    """
+    default_registry.warmup()
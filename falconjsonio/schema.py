@@ -1,51 +1,122 @@
-import jsonschema.validators
+from falconjsonio.compiler import CompiledValidator, UnsupportedSchema
+from falconjsonio.registry import LazyValidator, default_registry
+
 import inspect
 
 
 class SchemaDecoratorError(Exception): pass
 
 
+def derive_validator(validator, schema):
+    """
+    Build a validator for another schema (typically a sub-schema) of the same
+    kind as an existing one, sharing its resolver and format checker.
+    """
+    if isinstance(validator, LazyValidator):
+        validator = validator.get()
+    compiled = isinstance(validator, CompiledValidator)
+    if compiled:
+        validator = validator.validator
+
+    derived = validator.__class__(schema, resolver=validator.resolver, format_checker=validator.format_checker)
+    if compiled:
+        try:
+            derived = CompiledValidator(derived)
+        except UnsupportedSchema:
+            pass
+    return derived
+
+
 class _schema(object):
-    def __init__(self, schema, method_name=None, validator_cls=None, validator_args=None, validator_kwargs=None):
-        if validator_cls is None:
-            validator_cls = jsonschema.validators.validator_for(schema)
-        if validator_args is None:
-            validator_args = []
-        if validator_kwargs is None:
-            validator_kwargs = {}
-
-        validator_cls.check_schema(schema)
-        self.validator      = validator_cls(schema, *validator_args, **validator_kwargs)
+    def __init__(self, schema, method_name=None, validator_cls=None, validator_args=None, validator_kwargs=None, compiled=False, registry=None, lazy=None):
+        if registry is None:
+            registry = default_registry
+        if lazy is None:
+            lazy = registry.lazy
+
+        if lazy:
+            self.validator  = registry.lazy_validator(schema, validator_cls, validator_args, validator_kwargs, compiled)
+        else:
+            self.validator  = registry.validator(schema, validator_cls, validator_args, validator_kwargs, compiled)
         self.method_name    = method_name
 
 
+def _attach(decorator, klass_or_func, attr, value):
+    """
+    Store value as __<attr>__ on a responder, or in the __<attr>s__ dict of a
+    resource class under the decorator's method name.
+    """
+    if inspect.isclass(klass_or_func):
+        if decorator.method_name is None:
+            raise SchemaDecoratorError("Parameter 'method_name' must be supplied when applying {0} decorator to a class".format(decorator.__class__.__name__))
+        if not hasattr(klass_or_func, '__{0}s__'.format(attr)):
+            setattr(klass_or_func, '__{0}s__'.format(attr), {})
+        getattr(klass_or_func, '__{0}s__'.format(attr))[decorator.method_name] = value
+    else:
+        setattr(klass_or_func, '__{0}__'.format(attr), value)
+
+
 class request_schema(_schema):
     """
     Decorator to specify the JSON schema required for a request.
     """
     def __call__(self, klass_or_func):
-        if inspect.isclass(klass_or_func):
-            if self.method_name is None:
-                raise SchemaDecoratorError("Parameter 'method_name' must be supplied when applying request_schema decorator to a class")
-            if not hasattr(klass_or_func, '__request_schemas__'):
-                klass_or_func.__request_schemas__ = {}
-            klass_or_func.__request_schemas__[self.method_name] = self.validator
-        else:
-            klass_or_func.__request_schema__ = self.validator
+        _attach(self, klass_or_func, 'request_schema', self.validator)
         return klass_or_func
 
 
 class response_schema(_schema):
     """
     Decorator to specify the JSON schema a response should conform to.
+
+    Pass a falconjsonio.policy.ValidationPolicy as `validation` to override the
+    middleware's policy for this responder.
     """
+    def __init__(self, *args, **kwargs):
+        self.validation = kwargs.pop('validation', None)
+        super(response_schema, self).__init__(*args, **kwargs)
+
     def __call__(self, klass_or_func):
-        if inspect.isclass(klass_or_func):
-            if self.method_name is None:
-                raise SchemaDecoratorError("Parameter 'method_name' must be supplied when applying response_schema decorator to a class")
-            if not hasattr(klass_or_func, '__response_schemas__'):
-                klass_or_func.__response_schemas__ = {}
-            klass_or_func.__response_schemas__[self.method_name] = self.validator
-        else:
-            klass_or_func.__response_schema__ = self.validator
+        _attach(self, klass_or_func, 'response_schema', self.validator)
+        if self.validation is not None:
+            _attach(self, klass_or_func, 'response_validation', self.validation)
         return klass_or_func
+
+
+class etag(object):
+    """
+    Decorator supplying a version key for the document a GET responder would
+    return, as key(resource, req, params), so that requests for a version the
+    client already has are answered with 304 before the responder runs.  The
+    key function may return None to skip the check.
+    """
+    def __init__(self, key, method_name=None):
+        self.key            = key
+        self.method_name    = method_name
+
+    def __call__(self, klass_or_func):
+        _attach(self, klass_or_func, 'etag', self.key)
+        return klass_or_func
+
+
+class response_cache(object):
+    """
+    Decorator letting JSONTranslator cache the encoded (and validated) result
+    of a GET responder for `ttl` seconds (or the middleware's default), keyed
+    by the route parameters plus either the values of the `query_params` or
+    whatever key(req, params) returns.
+    """
+    def __init__(self, ttl=None, query_params=(), key=None, method_name=None):
+        self.ttl            = ttl
+        self.query_params   = tuple(query_params)
+        self.key            = key
+        self.method_name    = method_name
+
+    def __call__(self, klass_or_func):
+        _attach(self, klass_or_func, 'response_cache', self)
+        return klass_or_func
+
+    def cache_key(self, req, params):
+        if self.key is not None:
+            return self.key(req, params)
+        return tuple(req.get_param(name) for name in self.query_params)
@@ -1,9 +1,19 @@
-import falconjsonio.middleware, falconjsonio.schema
+import falconjsonio.batch, falconjsonio.bench, falconjsonio.cache, falconjsonio.codec, falconjsonio.compiler, falconjsonio.compression, falconjsonio.metrics, falconjsonio.middleware, falconjsonio.ndjson, falconjsonio.patch, falconjsonio.policy, falconjsonio.registry, falconjsonio.schema
 
+import concurrent.futures
+import dataclasses
 import falcon, falcon.testing
+import gzip
+try:
+    import falcon.asgi
+except ImportError:
+    # Falcon < 3
+    pass
+import itertools
 import json
 import jsonschema
 import logging
+import threading
 import unittest
 
 
@@ -148,6 +158,292 @@ class BadResource(object):
         resp.status = falcon.HTTP_200
         req.context['result'] = {'this': 'does not conform'}
 
+class CompiledResource(object):
+    def __init__(self):
+        self.received = None
+
+    @falconjsonio.schema.request_schema({
+        'type': 'object',
+        'properties': {
+            'email':    {'type': 'string'},
+            'password': {'type': 'string', 'minLength': 6},
+        },
+        'required': ['email', 'password'],
+    }, compiled=True)
+    @falconjsonio.schema.response_schema({
+        'type': 'object',
+        'properties': {
+            'email': {'type': 'string'},
+        },
+        'required': ['email'],
+    }, compiled=True)
+    def on_post(self, req, resp):
+        self.received = req.context['doc']
+        resp.status = falcon.HTTP_201
+        req.context['result'] = {'mail': req.context['doc']['email']}
+
+class StreamingResource(object):
+    def __init__(self):
+        self.rows = []
+
+    @falconjsonio.schema.response_schema({
+        'type': 'array',
+        'items': {
+            'type': 'object',
+            'properties': {
+                'id': {'type': 'integer'},
+            },
+            'required': ['id'],
+        },
+    })
+    def on_get(self, req, resp):
+        resp.status = falcon.HTTP_200
+        req.context['result_stream'] = (row for row in self.rows)
+
+class RowsResource(object):
+    def __init__(self, rows):
+        self.rows = rows
+
+    def on_get(self, req, resp):
+        resp.status = falcon.HTTP_200
+        req.context['result_stream'] = iter(self.rows)
+
+    def on_post(self, req, resp):
+        self.rows = list(req.context['doc'])
+        resp.status = falcon.HTTP_200
+        req.context['result'] = {'count': len(self.rows)}
+
+class LoggedOnlyResource(object):
+    @falconjsonio.schema.response_schema({
+        'type': 'object',
+        'properties': {
+            'id': {'type': 'integer'},
+        },
+        'required': ['id'],
+    }, validation=falconjsonio.policy.Always(block=False))
+    def on_get(self, req, resp):
+        resp.status = falcon.HTTP_200
+        req.context['result'] = {'this': 'does not conform'}
+
+class AsyncResource(object):
+    def __init__(self):
+        self.received   = None
+        self.threads    = set()
+
+    @falconjsonio.schema.request_schema({
+        'type': 'object',
+        'properties': {
+            'email':    {'type': 'string'},
+            'password': {'type': 'string'},
+        },
+        'required': ['email', 'password'],
+    })
+    @falconjsonio.schema.response_schema({
+        'type': 'object',
+        'properties': {
+            'email': {'type': 'string'},
+        },
+        'required': ['email'],
+    })
+    async def on_post(self, req, resp):
+        self.received = req.context['doc']
+        resp.status = falcon.HTTP_201
+        req.context['result'] = {'email': req.context['doc']['email']}
+
+    @falconjsonio.schema.response_schema({
+        'type': 'array',
+        'items': {'type': 'integer'},
+    })
+    async def on_get(self, req, resp):
+        count = req.get_param_as_int('count')
+        if count is None:
+            count = 10
+        if req.get_param('source') == 'async':
+            req.context['result_stream'] = self._items_async(count, req.get_param_as_int('invalid'))
+        else:
+            req.context['result_stream'] = self._items(count)
+
+    def _items(self, count):
+        for i in range(count):
+            self.threads.add(threading.get_ident())
+            yield i
+
+    async def _items_async(self, count, invalid):
+        for i in range(count):
+            yield 'invalid' if i == invalid else i
+
+class AsyncIngestResource(object):
+    @falconjsonio.schema.request_schema({
+        'type': 'array',
+        'items': {
+            'type': 'object',
+            'properties': {
+                'id': {'type': 'integer'},
+            },
+            'required': ['id'],
+        },
+    })
+    async def on_post(self, req, resp):
+        received = [record async for record in req.context['doc']]
+        resp.status = falcon.HTTP_200
+        req.context['result'] = {'received': received, 'skipped': req.context['skipped_records']}
+
+class BulkResource(object):
+    def __init__(self):
+        self.received = None
+
+    @falconjsonio.schema.request_schema({
+        'type': 'array',
+        'items': {
+            'type': 'object',
+            'properties': {
+                'id': {'type': 'integer'},
+            },
+            'required': ['id'],
+        },
+        'maxItems': 100,
+    })
+    def on_post(self, req, resp):
+        self.received = req.context['doc']
+        resp.status = falcon.HTTP_201
+
+class VersionedResource(object):
+    def __init__(self):
+        self.version = 1
+        self.calls = 0
+
+    @falconjsonio.schema.etag(lambda resource, req, params: resource.version)
+    @falconjsonio.schema.response_schema({
+        'type': 'object',
+        'properties': {
+            'version': {'type': 'integer'},
+        },
+        'required': ['version'],
+    })
+    def on_get(self, req, resp):
+        self.calls += 1
+        resp.status = falcon.HTTP_200
+        req.context['result'] = {'version': self.version}
+
+class CatalogResource(object):
+    def __init__(self):
+        self.calls = 0
+        self.names = {}
+
+    @falconjsonio.schema.response_cache(ttl=60, query_params=['page'])
+    @falconjsonio.schema.response_schema({
+        'type': 'object',
+        'properties': {
+            'name': {'type': 'string'},
+        },
+        'required': ['name'],
+    })
+    def on_get(self, req, resp, id):
+        self.calls += 1
+        resp.status = falcon.HTTP_200
+        resp.set_header('Cache-Control', 'max-age=60')
+        req.context['result'] = {'name': self.names.get(id, 'unnamed'), 'page': req.get_param('page')}
+
+    def on_put(self, req, resp, id):
+        self.names[id] = req.context['doc']['name']
+        req.context['invalidate'](self, {'id': id})
+        resp.status = falcon.HTTP_204
+
+class PeopleResource(object):
+    def __init__(self):
+        self.fields = None
+
+    @falconjsonio.schema.response_schema({
+        'type': 'array',
+        'items': {
+            'type': 'object',
+            'properties': {
+                'id':       {'type': 'integer'},
+                'name':     {'type': 'string'},
+                'email':    {'type': 'string'},
+            },
+            'required': ['id', 'name'],
+        },
+    })
+    def on_get(self, req, resp):
+        self.fields = req.context.get('fields')
+        resp.status = falcon.HTTP_200
+        req.context['result'] = [
+            {'id': 1, 'name': 'Alice', 'email': 'alice@example.com'},
+            {'id': 2, 'name': 'Bob', 'email': 'bob@example.com'},
+        ]
+
+@dataclasses.dataclass
+class Person(object):
+    id:     int
+    name:   str
+    tags:   list
+
+class PersonResource(object):
+    @falconjsonio.schema.response_schema({
+        'type': 'object',
+        'properties': {
+            'id':   {'type': 'integer'},
+            'name': {'type': 'string'},
+            'tags': {'type': 'array', 'items': {'type': 'string'}},
+        },
+        'required': ['id', 'name'],
+    })
+    def on_get(self, req, resp):
+        resp.status = falcon.HTTP_200
+        req.context['result'] = Person(1, 'Alice', ['a', 'b'])
+
+class IngestResource(object):
+    def __init__(self):
+        self.received = None
+
+    @falconjsonio.schema.request_schema({
+        'type': 'array',
+        'items': {
+            'type': 'object',
+            'properties': {
+                'id': {'type': 'integer'},
+            },
+            'required': ['id'],
+        },
+    })
+    def on_post(self, req, resp):
+        self.received = []
+        for record in req.context['doc']:
+            self.received.append(record)
+        resp.status = falcon.HTTP_200
+        req.context['result'] = {'count': len(self.received), 'skipped': req.context['skipped_records']}
+
+class AccountResource(object):
+    def __init__(self):
+        self.document = {'name': 'Alice', 'email': 'alice@example.com', 'address': {'city': 'Oslo'}, 'tags': []}
+        self.received = None
+
+    @falconjsonio.schema.request_schema({
+        'type': 'object',
+        'properties': {
+            'name':     {'type': 'string', 'maxLength': 10},
+            'email':    {'type': 'string'},
+            'address':  {
+                'type': 'object',
+                'properties': {
+                    'city': {'type': 'string'},
+                    'zip':  {'type': 'string', 'pattern': '^[0-9]{5}$'},
+                },
+                'required': ['city'],
+                'additionalProperties': False,
+            },
+            'tags':     {'type': 'array', 'items': {'type': 'string'}},
+        },
+        'required': ['name', 'email'],
+        'additionalProperties': False,
+    })
+    def on_patch(self, req, resp):
+        self.received = req.context['patch']
+        self.document = self.received.apply(self.document)
+        resp.status = falcon.HTTP_200
+        req.context['result'] = self.document
+
 class CollectingHandler(logging.Handler):
     def __init__(self):
         super(CollectingHandler, self).__init__()
@@ -191,13 +487,6 @@ class IOTest(unittest.TestCase):
         self.logger.handlers = []
         self.logger.addHandler(self.handler)
 
-        self.app = falcon.API(
-            middleware=[
-                falconjsonio.middleware.RequireJSON(),
-                falconjsonio.middleware.JSONTranslator(self.logger),
-            ],
-        )
-
         self.non_json_resource          = NonJSONResource()
         self.schemaless_json_resource   = SchemalessJSONResource()
         self.good_resource              = GoodResource()
@@ -205,16 +494,47 @@ class IOTest(unittest.TestCase):
         self.good_child_resource        = GoodChildResource()
         self.bad_child_resource         = BadChildResource()
         self.string_format_resource     = StringFormatResource()
-        self.app.add_route('/non_json_response',        self.non_json_resource)
-        self.app.add_route('/schemaless_json_response', self.schemaless_json_resource)
-        self.app.add_route('/good_response',            self.good_resource)
-        self.app.add_route('/bad_response',             self.bad_resource)
-        self.app.add_route('/good_child_response',      self.good_child_resource)
-        self.app.add_route('/bad_child_response',       self.bad_child_resource)
-        self.app.add_route('/string_format_response',   self.string_format_resource)
+        self.compiled_resource          = CompiledResource()
+        self.streaming_resource         = StreamingResource()
+        self.logged_only_resource       = LoggedOnlyResource()
+        self.bulk_resource              = BulkResource()
+        self.versioned_resource         = VersionedResource()
+        self.catalog_resource           = CatalogResource()
+        self.people_resource            = PeopleResource()
+        self.person_resource            = PersonResource()
+        self.ingest_resource            = IngestResource()
+        self.account_resource           = AccountResource()
+        self.app = self.create_app()
 
         self.srmock = falcon.testing.StartResponseMock()
 
+    def create_app(self, **translator_kwargs):
+        self.translator = falconjsonio.middleware.JSONTranslator(self.logger, **translator_kwargs)
+        app = falcon.API(
+            middleware=[
+                falconjsonio.middleware.RequireJSON(translator_kwargs.get('formats', ()), translator_kwargs.get('ndjson') is not None, translator_kwargs.get('patches', False)),
+                self.translator,
+            ],
+        )
+        app.add_route('/non_json_response',        self.non_json_resource)
+        app.add_route('/schemaless_json_response', self.schemaless_json_resource)
+        app.add_route('/good_response',            self.good_resource)
+        app.add_route('/bad_response',             self.bad_resource)
+        app.add_route('/good_child_response',      self.good_child_resource)
+        app.add_route('/bad_child_response',       self.bad_child_resource)
+        app.add_route('/string_format_response',   self.string_format_resource)
+        app.add_route('/compiled_response',        self.compiled_resource)
+        app.add_route('/streaming_response',       self.streaming_resource)
+        app.add_route('/logged_only_response',     self.logged_only_resource)
+        app.add_route('/bulk_response',            self.bulk_resource)
+        app.add_route('/versioned_response',       self.versioned_resource)
+        app.add_route('/catalog/{id}',             self.catalog_resource)
+        app.add_route('/people',                   self.people_resource)
+        app.add_route('/person',                   self.person_resource)
+        app.add_route('/ingest',                   self.ingest_resource)
+        app.add_route('/account',                  self.account_resource)
+        return app
+
     def simulate_request(self, path, *args, **kwargs):
         env = falcon.testing.create_environ(path=path, **kwargs)
         return self.app(env, self.srmock)
@@ -387,3 +707,1089 @@ On instance:
     def test_non_conforming_string_format_custom(self):
         self.simulate_request('/string_format_response', method='POST', body=json.dumps({'allcaps': 'not allcaps'}), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
         self.assertEqual(self.srmock.status, '400 Bad Request')
+
+    def test_schema_resolution_cached(self):
+        falconjsonio.middleware.clear_schema_cache()
+        self.simulate_request('/good_response', method='POST', body=json.dumps({'email': 'foo@example.com', 'password': 'hunter2'}), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        self.assertEqual(self.srmock.status, '201 Created')
+        route = falconjsonio.middleware._route_cache[(GoodResource, 'POST')]
+        self.assertEqual(route.request_schema, GoodResource.on_post.__request_schema__)
+        self.assertEqual(route.response_schema, GoodResource.on_post.__response_schema__)
+
+    def test_prime_schema_cache(self):
+        falconjsonio.middleware.clear_schema_cache()
+        falconjsonio.middleware.prime_schema_cache(self.good_child_resource)
+        route = falconjsonio.middleware._route_cache[(GoodChildResource, 'POST')]
+        self.assertEqual(route.request_schema, GoodChildResource.__request_schemas__['on_post'])
+        self.assertEqual(route.response_schema, GoodChildResource.__response_schemas__['on_post'])
+        route = falconjsonio.middleware._route_cache[(GoodChildResource, 'GET')]
+        self.assertEqual((route.request_schema, route.response_schema), (None, None))
+
+    def test_compiled_post(self):
+        self.assertIsInstance(CompiledResource.on_post.__request_schema__, falconjsonio.compiler.CompiledValidator)
+        response, = self.simulate_request('/compiled_response', method='POST', body=json.dumps({'email': 'foo@example.com', 'password': 'hunter2'}), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        self.assertEqual(self.compiled_resource.received, {'email': 'foo@example.com', 'password': 'hunter2'})
+        # Response does not conform, and the error is the one jsonschema reports
+        self.assertEqual(self.srmock.status, '500 Internal Server Error')
+        self.assertIn("'email' is a required property", self.handler.logs[0].message)
+
+    def test_compiled_nonconforming_post_request(self):
+        response, = self.simulate_request('/compiled_response', method='POST', body=json.dumps({'email': 'foo@example.com', 'password': 'hunt'}), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        self.assertEqual(self.compiled_resource.received, None)
+        self.assertEqual(self.srmock.status, '400 Bad Request')
+        self.assertEqual(json.loads(json.loads(response.decode('utf-8'))['description']), {'error': str(next(CompiledResource.on_post.__request_schema__.iter_errors({'email': 'foo@example.com', 'password': 'hunt'})))})
+
+    def test_compiled_matches_interpreted(self):
+        schema = {
+            'type': 'object',
+            'properties': {
+                'id':    {'type': 'integer', 'minimum': 1, 'maximum': 5, 'exclusiveMaximum': True},
+                'name':  {'type': ['string', 'null'], 'pattern': '^x', 'maxLength': 3},
+                'kind':  {'enum': [1, 'x', None, True]},
+                'tags':  {'type': 'array', 'items': {'type': 'string'}, 'minItems': 1},
+                'value': {'oneOf': [{'type': 'integer'}, {'type': 'number'}]},
+                'other': {'not': {'type': 'integer'}},
+            },
+            'required': ['id'],
+            'additionalProperties': False,
+        }
+        validator = jsonschema.Draft4Validator(schema)
+        compiled = falconjsonio.compiler.CompiledValidator(validator)
+        for instance in [
+            {'id': 1}, {'id': 5}, {'id': True}, {'id': 1.0}, {}, [], None, {'id': 2, 'extra': 1},
+            {'id': 2, 'name': 'xyz'}, {'id': 2, 'name': 'xyzz'}, {'id': 2, 'name': 'abc'}, {'id': 2, 'name': None},
+            {'id': 2, 'kind': 1}, {'id': 2, 'kind': 1.0}, {'id': 2, 'kind': True}, {'id': 2, 'kind': False}, {'id': 2, 'kind': 'y'},
+            {'id': 2, 'tags': []}, {'id': 2, 'tags': ['a']}, {'id': 2, 'tags': [1]},
+            {'id': 2, 'value': 1}, {'id': 2, 'value': 1.5}, {'id': 2, 'other': 1}, {'id': 2, 'other': 'a'},
+        ]:
+            self.assertEqual(compiled.check(instance), validator.is_valid(instance), instance)
+
+    def test_compiled_unsupported_falls_back(self):
+        decorator = falconjsonio.schema.request_schema({'patternProperties': {'^a': {'type': 'string'}}}, compiled=True)
+        self.assertNotIsInstance(decorator.validator, falconjsonio.compiler.CompiledValidator)
+
+    def test_codecs(self):
+        for name in ['json', 'orjson', 'rapidjson', 'ujson']:
+            try:
+                codec = falconjsonio.codec.get_codec(name)
+            except ImportError:
+                continue
+            self.app = self.create_app(codec=codec)
+
+            response, = self.simulate_request('/good_response', method='POST', body=json.dumps({'email': 'foo@example.com', 'password': 'hunter2'}), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+            self.assertEqual(self.srmock.status, '201 Created', name)
+            self.assertEqual(json.loads(response.decode('utf-8')), {'email': 'foo@example.com'}, name)
+
+            self.simulate_request('/good_response', method='POST', body=b'{"email": "\xff"}', headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+            self.assertEqual(self.srmock.status, '400 Bad Request', name)
+
+    def test_get_codec(self):
+        self.assertIsInstance(falconjsonio.codec.get_codec('json'), falconjsonio.codec.StdlibCodec)
+        self.assertIsInstance(falconjsonio.codec.get_codec(), falconjsonio.codec.JSONCodec)
+        with self.assertRaises(ValueError):
+            falconjsonio.codec.get_codec('nonexistent')
+
+    def test_body_too_large(self):
+        self.app = self.create_app(max_body_size=32)
+        self.simulate_request('/good_response', method='POST', body=json.dumps({'email': 'foo@example.com', 'password': 'hunter2'}), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        self.assertEqual(self.srmock.status, '413 Payload Too Large')
+        self.assertEqual(self.good_resource.received, None)
+
+    def test_body_too_large_without_content_length(self):
+        self.app = self.create_app(max_body_size=32, chunk_size=4)
+        env = falcon.testing.create_environ(path='/good_response', method='POST', body=json.dumps({'email': 'foo@example.com', 'password': 'hunter2'}), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        del env['CONTENT_LENGTH']
+        self.app(env, self.srmock)
+        self.assertEqual(self.srmock.status, '413 Payload Too Large')
+        self.assertEqual(self.good_resource.received, None)
+
+    def test_body_within_limit_without_content_length(self):
+        bodies = []
+        class RecordingCodec(falconjsonio.codec.StdlibCodec):
+            def loads(self, data):
+                bodies.append(data)
+                return super(RecordingCodec, self).loads(data)
+
+        self.app = self.create_app(max_body_size=64, chunk_size=4, codec=RecordingCodec())
+        env = falcon.testing.create_environ(path='/good_response', method='POST', body=json.dumps({'email': 'foo@example.com', 'password': 'hunter2'}), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        del env['CONTENT_LENGTH']
+        self.app(env, self.srmock)
+        self.assertEqual(self.srmock.status, '201 Created')
+        self.assertEqual(self.good_resource.received, {'email': 'foo@example.com', 'password': 'hunter2'})
+        # The read buffer is decoded without being copied first
+        self.assertIsInstance(bodies[0], bytearray)
+
+    def test_streamed_result(self):
+        self.app = self.create_app(chunk_size=16)
+        self.streaming_resource.rows = [{'id': i} for i in range(100)]
+        response = self.simulate_request('/streaming_response', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(self.srmock.status, '200 OK')
+        chunks = list(response)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(json.loads(b''.join(chunks).decode('utf-8')), self.streaming_resource.rows)
+
+    def test_streamed_empty_result(self):
+        response = self.simulate_request('/streaming_response', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(self.srmock.status, '200 OK')
+        self.assertEqual(json.loads(b''.join(response).decode('utf-8')), [])
+
+    def test_streamed_nonconforming_result(self):
+        self.streaming_resource.rows = [{'id': 1}, {'id': 2}, {'this': 'does not conform'}, {'id': 4}]
+        response = self.simulate_request('/streaming_response', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(self.srmock.status, '200 OK')
+        body = b''.join(response).decode('utf-8')
+        # Document is cut short before the offending item
+        self.assertEqual(body, '[{"id": 1},{"id": 2}')
+        self.assertIn('as item 2 does not match the defined schema', self.handler.logs[0].message)
+
+    def test_streamed_result_schemas(self):
+        registry = falconjsonio.registry.SchemaRegistry()
+        registry.register('row', {'type': 'object', 'properties': {'id': {'type': 'integer'}}, 'required': ['id']})
+        registry.register('rows', {'type': 'array', 'items': {'$ref': 'row'}})
+        for index, (schema, rows, body) in enumerate([
+            # Items of referenced schemas are validated as they come
+            ({'$ref': 'rows'}, [{'id': 1}, {'id': 2}], '[{"id": 1},{"id": 2}]'),
+            ({'$ref': 'rows'}, [{'id': 1}, {'nope': 2}], '[{"id": 1}'),
+            # Others are validated once collected
+            ({'type': 'array', 'items': {'type': 'integer'}, 'maxItems': 2}, [1, 2], '[1,2]'),
+            ({'type': 'array', 'items': {'type': 'integer'}, 'maxItems': 2}, [1, 2, 3], '[1,2,3'),
+            ({'type': 'array', 'items': [{'type': 'integer'}, {'type': 'string'}]}, [1, 2], '[1,2'),
+            ({'allOf': [{'$ref': 'rows'}]}, [{'id': 1}, {'nope': 2}], '[{"id": 1},{"nope": 2}'),
+        ]):
+            resource = falconjsonio.schema.response_schema(schema, method_name='on_get', registry=registry)(type('RowsResource', (RowsResource,), {}))(rows)
+            self.app.add_route('/rows/{0}'.format(index), resource)
+            response = self.simulate_request('/rows/{0}'.format(index), method='GET', headers={'Accept': 'application/json'})
+            self.assertEqual(b''.join(response).decode('utf-8'), body, schema)
+
+    def test_response_validation_never(self):
+        self.app = self.create_app(response_validation=falconjsonio.policy.Never())
+        response, = self.simulate_request('/bad_response', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(self.srmock.status, '200 OK')
+        self.assertEqual(json.loads(response.decode('utf-8')), {'this': 'does not conform'})
+        self.assertEqual(self.handler.logs, [])
+
+    def test_response_validation_sample(self):
+        self.app = self.create_app(response_validation=falconjsonio.policy.Sample(0.0))
+        self.simulate_request('/bad_response', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(self.srmock.status, '200 OK')
+
+        self.app = self.create_app(response_validation=falconjsonio.policy.Sample(1.0))
+        self.simulate_request('/bad_response', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(self.srmock.status, '500 Internal Server Error')
+
+    def test_response_validation_sample_log_only(self):
+        self.app = self.create_app(response_validation=falconjsonio.policy.Sample(1.0, block=False))
+        response, = self.simulate_request('/bad_response', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(self.srmock.status, '200 OK')
+        self.assertEqual(json.loads(response.decode('utf-8')), {'this': 'does not conform'})
+        self.assertTrue(self.handler.logs[0].message.startswith('Sending response from falconjsonio.test.BadResource.on_get to client although it does not match the defined schema'))
+
+    def test_response_validation_time_budget(self):
+        policy = falconjsonio.policy.TimeBudget(60.0)
+        self.app = self.create_app(response_validation=policy)
+        self.simulate_request('/bad_response', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(self.srmock.status, '500 Internal Server Error')
+        self.assertGreater(policy.spent, 0.0)
+
+        # Budget used up for this interval
+        policy.spent = 60.0
+        self.simulate_request('/bad_response', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(self.srmock.status, '200 OK')
+
+    def test_response_validation_decorator_policy(self):
+        response, = self.simulate_request('/logged_only_response', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(self.srmock.status, '200 OK')
+        self.assertEqual(len(self.handler.logs), 1)
+
+    def test_validation_cache(self):
+        self.app = self.create_app(validation_cache_size=10)
+        headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+        body = json.dumps({'email': 'foo@example.com', 'password': 'hunter2'})
+
+        self.simulate_request('/good_response', method='POST', body=body, headers=headers)
+        first = self.good_resource.received
+        first['email'] = 'changed by handler'
+
+        self.simulate_request('/good_response', method='POST', body=body, headers=headers)
+        self.assertEqual(self.srmock.status, '201 Created')
+        self.assertEqual(self.good_resource.received, {'email': 'foo@example.com', 'password': 'hunter2'})
+        self.assertIsNot(self.good_resource.received, first)
+
+        for i in range(2):
+            response, = self.simulate_request('/good_response', method='POST', body=json.dumps({'email': 'foo@example.com'}), headers=headers)
+            self.assertEqual(self.srmock.status, '400 Bad Request')
+            self.assertEqual(json.loads(response.decode('utf-8'))['title'], 'Invalid request body')
+
+        stats = self.translator.validation_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (2, 2, 2))
+
+    def test_validation_cache_eviction_and_ttl(self):
+        cache = falconjsonio.cache.LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+        cache = falconjsonio.cache.LRUCache(2, ttl=-1)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_metrics(self):
+        sink = falconjsonio.metrics.HistogramSink()
+        self.app = self.create_app(metrics=sink)
+        self.simulate_request('/good_response', method='POST', body=json.dumps({'email': 'foo@example.com', 'password': 'hunter2'}), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        self.assertEqual(self.srmock.status, '201 Created')
+
+        snapshot = sink.snapshot()
+        self.assertEqual(
+            sorted(metric for resource, responder, metric in snapshot),
+            ['decode', 'encode', 'read', 'request_size', 'response_size', 'validate', 'validate_response'],
+        )
+        request_size = snapshot[('falconjsonio.test.GoodResource', 'on_post', 'request_size')]
+        self.assertEqual((request_size['count'], request_size['sum']), (1, len(json.dumps({'email': 'foo@example.com', 'password': 'hunter2'}))))
+        self.assertEqual(request_size['buckets'][0], (256, 1))
+
+        text = sink.prometheus_text()
+        self.assertIn('# TYPE falconjsonio_request_size_bytes histogram\n', text)
+        self.assertIn('falconjsonio_request_size_bytes_bucket{resource="falconjsonio.test.GoodResource",responder="on_post",le="+Inf"} 1\n', text)
+        self.assertIn('falconjsonio_validate_seconds_count{resource="falconjsonio.test.GoodResource",responder="on_post"} 1\n', text)
+
+        # Families are not split across resources
+        sink.observe('a.A', 'on_get', 'encode', 0.1)
+        sink.observe('b.B', 'on_get', 'decode', 0.1)
+        names = [line.split('{', 1)[0].rsplit('_', 1)[0] for line in sink.prometheus_text().splitlines() if not line.startswith('#')]
+        families = [name for name, _ in itertools.groupby(names)]
+        self.assertEqual(len(families), len(set(families)))
+
+        self.app.add_route('/metrics', falconjsonio.metrics.PrometheusResource(sink))
+        response, = self.simulate_request('/metrics', method='GET')
+        self.assertEqual(self.srmock.status, '200 OK')
+        self.assertEqual(response.decode('utf-8'), sink.prometheus_text())
+
+    def test_metrics_callback(self):
+        observations = []
+        self.app = self.create_app(metrics=falconjsonio.metrics.CallbackSink(lambda *args: observations.append(args)))
+        self.streaming_resource.rows = [{'id': 1}]
+        b''.join(self.simulate_request('/streaming_response', method='GET', headers={'Accept': 'application/json'}))
+        self.assertEqual(
+            [(resource, responder, metric) for resource, responder, metric, value in observations],
+            [
+                ('falconjsonio.test.StreamingResource', 'on_get', 'validate_response'),
+                ('falconjsonio.test.StreamingResource', 'on_get', 'encode'),
+                ('falconjsonio.test.StreamingResource', 'on_get', 'response_size'),
+            ],
+        )
+        self.assertEqual(observations[-1][-1], len(b'[{"id": 1}]'))
+
+    def test_bench(self):
+        baseline = falconjsonio.bench.run(duration=0, schemas=['simple'], payloads=['small'])
+        result, = baseline['results']
+        self.assertEqual((result['schema'], result['payload']), ('simple', 'small'))
+        self.assertGreaterEqual(result['requests'], 3)
+        self.assertIn('validate', result['stages'])
+
+        current = json.loads(json.dumps(baseline))
+        current['results'][0]['requests_per_sec'] = result['requests_per_sec'] * 0.5
+        report, regressed = falconjsonio.bench.compare(baseline, current, 0.1)
+        self.assertTrue(regressed)
+        self.assertIn('REGRESSION', report)
+        self.assertFalse(falconjsonio.bench.compare(baseline, baseline, 0.1)[1])
+
+    def test_registry_shares_validators(self):
+        registry = falconjsonio.registry.SchemaRegistry()
+        first = falconjsonio.schema.request_schema({'type': 'object', 'required': ['a', 'b']}, registry=registry)
+        second = falconjsonio.schema.response_schema({'required': ['a', 'b'], 'type': 'object'}, registry=registry)
+        third = falconjsonio.schema.response_schema({'required': ['a', 'b'], 'type': 'object'}, registry=registry, compiled=True)
+        self.assertIs(first.validator, second.validator)
+        self.assertIsNot(first.validator, third.validator)
+        self.assertEqual(len(registry.validators), 2)
+
+    def test_registry_references(self):
+        registry = falconjsonio.registry.SchemaRegistry()
+        registry.register('money', {
+            'type': 'object',
+            'properties': {
+                'amount':   {'type': 'integer'},
+                'currency': {'type': 'string', 'pattern': '^[A-Z]{3}$'},
+            },
+            'required': ['amount', 'currency'],
+        })
+        for compiled in [False, True]:
+            validator = falconjsonio.schema.request_schema({
+                'type': 'object',
+                'properties': {
+                    'price':    {'$ref': 'money'},
+                    'discount': {'$ref': 'money#/properties/amount'},
+                },
+            }, registry=registry, compiled=compiled).validator
+            self.assertEqual(isinstance(validator, falconjsonio.compiler.CompiledValidator), compiled)
+            validator.validate({'price': {'amount': 100, 'currency': 'EUR'}, 'discount': 5})
+            with self.assertRaises(jsonschema.exceptions.ValidationError):
+                validator.validate({'price': {'amount': 100, 'currency': 'euro'}})
+            with self.assertRaises(jsonschema.exceptions.ValidationError):
+                validator.validate({'discount': 'five'})
+
+    def test_compiled_recursive_reference(self):
+        validator = falconjsonio.schema.request_schema({
+            'type': 'object',
+            'properties': {
+                'name':     {'type': 'string'},
+                'children': {'type': 'array', 'items': {'$ref': '#'}},
+            },
+        }, compiled=True).validator
+        self.assertIsInstance(validator, falconjsonio.compiler.CompiledValidator)
+        self.assertTrue(validator.check({'name': 'a', 'children': [{'name': 'b', 'children': [{'name': 'c'}]}]}))
+        self.assertFalse(validator.check({'name': 'a', 'children': [{'name': 'b', 'children': [{'name': 3}]}]}))
+
+    def test_lazy_validator(self):
+        registry = falconjsonio.registry.SchemaRegistry(lazy=True)
+        decorator = falconjsonio.schema.request_schema({'type': 'object', 'required': ['a']}, registry=registry, compiled=True)
+        self.assertIsInstance(decorator.validator, falconjsonio.registry.LazyValidator)
+        self.assertEqual(registry.validators, {})
+
+        self.assertTrue(decorator.validator.is_valid({'a': 1}))
+        with self.assertRaises(jsonschema.exceptions.ValidationError):
+            decorator.validator.validate({})
+        self.assertIsInstance(decorator.validator.get(), falconjsonio.compiler.CompiledValidator)
+        self.assertEqual(len(registry.validators), 1)
+
+    def test_lazy_validator_warmup(self):
+        registry = falconjsonio.registry.SchemaRegistry(lazy=True)
+        falconjsonio.schema.request_schema({'type': 'object'}, registry=registry)
+        # Invalid schemas are only reported once built
+        falconjsonio.schema.response_schema({'type': 12}, registry=registry)
+        with self.assertRaises(jsonschema.exceptions.SchemaError):
+            registry.warmup()
+
+        registry = falconjsonio.registry.SchemaRegistry()
+        decorator = falconjsonio.schema.request_schema({'type': 'object'}, registry=registry, lazy=True)
+        registry.warmup()
+        self.assertIsNotNone(decorator.validator._validator)
+        self.assertEqual(registry.pending, [])
+
+    def test_lazy_validator_builds_once(self):
+        built = []
+        def build():
+            built.append(None)
+            return jsonschema.Draft4Validator({})
+        validator = falconjsonio.registry.LazyValidator({}, build)
+        threads = [threading.Thread(target=validator.get) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(built), 1)
+
+    def test_error_mode_first(self):
+        self.app = self.create_app(error_mode='first')
+        response, = self.simulate_request('/good_response', method='POST', body=json.dumps({'email': 12}), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        self.assertEqual(self.srmock.status, '400 Bad Request')
+        body = json.loads(response.decode('utf-8'))
+        self.assertEqual(body['title'], 'Invalid request body')
+        self.assertEqual(len(body['errors']), 1)
+        self.assertIn(body['errors'][0], [{'path': '', 'keyword': 'required'}, {'path': '/email', 'keyword': 'type'}])
+
+    def test_error_mode_all(self):
+        self.app = self.create_app(error_mode='all')
+        response, = self.simulate_request('/good_response', method='POST', body=json.dumps({'email': 12, 'password': ['a/b~']}), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        self.assertEqual(self.srmock.status, '400 Bad Request')
+        self.assertEqual(
+            sorted(json.loads(response.decode('utf-8'))['errors'], key=lambda error: error['path']),
+            [{'path': '/email', 'keyword': 'type'}, {'path': '/password', 'keyword': 'type'}],
+        )
+
+        self.app = self.create_app(error_mode='all', max_errors=1)
+        response, = self.simulate_request('/good_response', method='POST', body=json.dumps({'email': 12, 'password': 12}), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        self.assertEqual(len(json.loads(response.decode('utf-8'))['errors']), 1)
+
+    def test_error_mode_cached(self):
+        self.app = self.create_app(error_mode='first', validation_cache_size=10)
+        for i in range(2):
+            response, = self.simulate_request('/good_response', method='POST', body=json.dumps({'email': 'foo@example.com'}), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+            self.assertEqual(self.srmock.status, '400 Bad Request')
+            self.assertEqual(json.loads(response.decode('utf-8'))['errors'], [{'path': '', 'keyword': 'required'}])
+        self.assertEqual(self.translator.validation_cache.hits, 1)
+
+    def test_json_pointer(self):
+        self.assertEqual(falconjsonio.middleware._json_pointer([]), '')
+        self.assertEqual(falconjsonio.middleware._json_pointer(['a/b', 0, 'c~d']), '/a~1b/0/c~0d')
+
+    def test_invalid_error_mode(self):
+        with self.assertRaises(ValueError):
+            falconjsonio.middleware.JSONTranslator(error_mode='verbose')
+
+    def test_parallel_validation(self):
+        headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+        items = [{'id': i} for i in range(50)]
+        items[7] = {'id': 'seven'}
+        items[31] = {}
+        items[44] = {'id': None}
+        for executor in [concurrent.futures.ThreadPoolExecutor(2), concurrent.futures.ProcessPoolExecutor(2)]:
+            with executor:
+                self.app = self.create_app(parallel_threshold=10, parallel_executor=executor, parallel_chunk_size=8, error_mode='all')
+                self.simulate_request('/bulk_response', method='POST', body=json.dumps([{'id': i} for i in range(50)]), headers=headers)
+                self.assertEqual(self.srmock.status, '201 Created')
+                self.assertEqual(len(self.bulk_resource.received), 50)
+
+                response, = self.simulate_request('/bulk_response', method='POST', body=json.dumps(items), headers=headers)
+                self.assertEqual(self.srmock.status, '400 Bad Request')
+                self.assertEqual(json.loads(response.decode('utf-8'))['errors'], [
+                    {'path': '/7/id', 'keyword': 'type'},
+                    {'path': '/31', 'keyword': 'required'},
+                    {'path': '/44/id', 'keyword': 'type'},
+                ])
+
+                # Array-level keywords are still checked
+                response, = self.simulate_request('/bulk_response', method='POST', body=json.dumps([{'id': i} for i in range(101)]), headers=headers)
+                self.assertEqual(json.loads(response.decode('utf-8'))['errors'], [{'path': '', 'keyword': 'maxItems'}])
+
+    def test_parallel_validation_full_error(self):
+        items = [{'id': i} for i in range(50)]
+        items[31] = {}
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            self.app = self.create_app(parallel_threshold=10, parallel_executor=executor, parallel_chunk_size=8)
+            response, = self.simulate_request('/bulk_response', method='POST', body=json.dumps(items), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        self.assertEqual(self.srmock.status, '400 Bad Request')
+        serial_error = next(BulkResource.on_post.__request_schema__.iter_errors(items))
+        self.assertEqual(json.loads(json.loads(response.decode('utf-8'))['description']), {'error': str(serial_error)})
+
+    def test_binary_formats(self):
+        for codec_cls in [falconjsonio.codec.MsgpackCodec, falconjsonio.codec.CborCodec]:
+            try:
+                codec = codec_cls()
+            except ImportError:
+                continue
+            self.app = self.create_app(formats=[codec])
+            headers = {'Accept': codec.media_type, 'Content-Type': codec.media_type}
+
+            response, = self.simulate_request('/good_response', method='POST', body=codec.dumps({'email': 'foo@example.com', 'password': 'hunter2'}), headers=headers)
+            self.assertEqual(self.srmock.status, '201 Created', codec.name)
+            self.assertEqual(self.good_resource.received, {'email': 'foo@example.com', 'password': 'hunter2'})
+            self.assertEqual(self.srmock.headers_dict['Content-Type'], codec.media_type)
+            self.assertEqual(codec.loads(response), {'email': 'foo@example.com'})
+
+            self.simulate_request('/good_response', method='POST', body=codec.dumps({'email': 'foo@example.com'}), headers=headers)
+            self.assertEqual(self.srmock.status, '400 Bad Request', codec.name)
+            self.simulate_request('/good_response', method='POST', body=b'\xc1\xff', headers=headers)
+            self.assertEqual(self.srmock.status, '400 Bad Request', codec.name)
+
+            # JSON is answered with JSON, and preferred when the client does not care
+            for accept in ['application/json', '*/*', 'application/json, {0}'.format(codec.media_type)]:
+                response, = self.simulate_request('/good_response', method='POST', body=codec.dumps({'email': 'foo@example.com', 'password': 'hunter2'}), headers={'Accept': accept, 'Content-Type': codec.media_type})
+                self.assertEqual(json.loads(response.decode('utf-8')), {'email': 'foo@example.com'}, accept)
+
+            self.streaming_resource.rows = [{'id': i} for i in range(100)]
+            response = self.simulate_request('/streaming_response', method='GET', headers={'Accept': codec.media_type})
+            self.assertEqual(codec.loads(b''.join(response)), self.streaming_resource.rows)
+
+    def test_binary_formats_not_configured(self):
+        self.app = self.create_app()
+        self.simulate_request('/good_response', method='POST', body=b'\x80', headers={'Accept': 'application/json', 'Content-Type': 'application/msgpack'})
+        self.assertEqual(self.srmock.status, '415 Unsupported Media Type')
+        self.simulate_request('/good_response', method='POST', body=json.dumps({'email': 'foo@example.com', 'password': 'hunter2'}), headers={'Accept': 'application/msgpack', 'Content-Type': 'application/json'})
+        self.assertEqual(self.srmock.status, '406 Not Acceptable')
+
+    def test_compressed_request(self):
+        self.app = self.create_app(max_body_size=1024)
+        body = json.dumps({'email': 'foo@example.com', 'password': 'hunter2'}).encode('utf-8')
+        for encoding in falconjsonio.compression.available_encodings():
+            compressor = encoding.compressor()
+            self.good_resource.received = None
+            self.simulate_request('/good_response', method='POST', body=compressor.compress(body) + compressor.flush(), headers={'Accept': 'application/json', 'Content-Type': 'application/json', 'Content-Encoding': encoding.name})
+            self.assertEqual(self.srmock.status, '201 Created', encoding.name)
+            self.assertEqual(self.good_resource.received, {'email': 'foo@example.com', 'password': 'hunter2'})
+
+            # Decompression bomb
+            compressor = encoding.compressor()
+            bomb = json.dumps({'email': 'foo@example.com', 'password': 'x' * 100000}).encode('utf-8')
+            self.simulate_request('/good_response', method='POST', body=compressor.compress(bomb) + compressor.flush(), headers={'Accept': 'application/json', 'Content-Type': 'application/json', 'Content-Encoding': encoding.name})
+            self.assertEqual(self.srmock.status, '413 Payload Too Large', encoding.name)
+
+            self.simulate_request('/good_response', method='POST', body=body, headers={'Accept': 'application/json', 'Content-Type': 'application/json', 'Content-Encoding': encoding.name})
+            self.assertEqual(self.srmock.status, '400 Bad Request', encoding.name)
+
+        self.simulate_request('/good_response', method='POST', body=body, headers={'Accept': 'application/json', 'Content-Type': 'application/json', 'Content-Encoding': 'compress'})
+        self.assertEqual(self.srmock.status, '415 Unsupported Media Type')
+
+        # Limited even without a body size limit
+        self.app = self.create_app()
+        bomb = b'{"email": "foo@example.com", "password": "hunter2"' + b' ' * (falconjsonio.compression.DEFAULT_MAX_DECOMPRESSED_SIZE + 1) + b'}'
+        self.simulate_request('/good_response', method='POST', body=gzip.compress(bomb), headers={'Accept': 'application/json', 'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+        self.assertEqual(self.srmock.status, '413 Payload Too Large')
+
+    def test_compressed_response(self):
+        self.app = self.create_app(compression_threshold=64)
+        self.streaming_resource.rows = [{'id': i} for i in range(100)]
+        for encoding in falconjsonio.compression.available_encodings():
+            response = b''.join(self.simulate_request('/streaming_response', method='GET', headers={'Accept': 'application/json', 'Accept-Encoding': encoding.name}))
+            self.assertEqual(self.srmock.headers_dict['Content-Encoding'], encoding.name)
+            self.assertEqual(json.loads(falconjsonio.compression.decompress(encoding, response, None).decode('utf-8')), self.streaming_resource.rows)
+
+        response, = self.simulate_request('/good_response', method='POST', body=json.dumps({'email': 'foo@' + 'x' * 100 + '.com', 'password': 'hunter2'}), headers={'Accept': 'application/json', 'Content-Type': 'application/json', 'Accept-Encoding': 'gzip;q=0.5, identity, deflate;q=0.1'})
+        self.assertEqual(self.srmock.headers_dict['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(falconjsonio.compression.decompress(falconjsonio.compression.GzipEncoding(), response, None).decode('utf-8')), {'email': 'foo@' + 'x' * 100 + '.com'})
+
+        # Below the threshold, or not accepted by the client
+        for accept_encoding in ['gzip', 'gzip;q=0, identity']:
+            email = 'foo@example.com' if accept_encoding == 'gzip' else 'foo@' + 'x' * 100 + '.com'
+            response, = self.simulate_request('/good_response', method='POST', body=json.dumps({'email': email, 'password': 'hunter2'}), headers={'Accept': 'application/json', 'Content-Type': 'application/json', 'Accept-Encoding': accept_encoding})
+            self.assertNotIn('Content-Encoding', self.srmock.headers_dict)
+            self.assertEqual(json.loads(response.decode('utf-8')), {'email': email})
+
+    def test_etag(self):
+        self.app = self.create_app(etags=True)
+        response, = self.simulate_request('/good_response', method='GET', headers={'Accept': 'application/json'})
+        etag = self.srmock.headers_dict['ETag']
+        self.assertEqual(json.loads(response.decode('utf-8')), {'id': 12345})
+
+        for if_none_match in [etag, 'W/' + etag, '"other", ' + etag, '*']:
+            response = self.simulate_request('/good_response', method='GET', headers={'Accept': 'application/json', 'If-None-Match': if_none_match})
+            self.assertEqual(self.srmock.status, '304 Not Modified', if_none_match)
+            self.assertEqual(b''.join(response), b'')
+
+        self.simulate_request('/good_response', method='GET', headers={'Accept': 'application/json', 'If-None-Match': '"other"'})
+        self.assertEqual(self.srmock.status, '200 OK')
+
+    def test_etag_disabled(self):
+        self.simulate_request('/good_response', method='GET', headers={'Accept': 'application/json'})
+        self.assertNotIn('ETag', self.srmock.headers_dict)
+
+    def test_etag_from_resource(self):
+        response, = self.simulate_request('/versioned_response', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(self.srmock.headers_dict['ETag'], '"1"')
+        self.assertEqual(json.loads(response.decode('utf-8')), {'version': 1})
+        self.assertEqual(self.versioned_resource.calls, 1)
+
+        # The responder does not even run
+        self.simulate_request('/versioned_response', method='GET', headers={'Accept': 'application/json', 'If-None-Match': '"1"'})
+        self.assertEqual(self.srmock.status, '304 Not Modified')
+        self.assertEqual(self.srmock.headers_dict['ETag'], '"1"')
+        self.assertEqual(self.versioned_resource.calls, 1)
+
+        self.versioned_resource.version = 2
+        response, = self.simulate_request('/versioned_response', method='GET', headers={'Accept': 'application/json', 'If-None-Match': '"1"'})
+        self.assertEqual(self.srmock.status, '200 OK')
+        self.assertEqual(self.srmock.headers_dict['ETag'], '"2"')
+        self.assertEqual(self.versioned_resource.calls, 2)
+
+    def test_etag_compressed(self):
+        self.app = self.create_app(compression_threshold=1)
+        self.simulate_request('/versioned_response', method='GET', headers={'Accept': 'application/json', 'Accept-Encoding': 'gzip'})
+        self.assertEqual(self.srmock.headers_dict['ETag'], '"1-gzip"')
+
+        self.simulate_request('/versioned_response', method='GET', headers={'Accept': 'application/json', 'Accept-Encoding': 'gzip', 'If-None-Match': '"1-gzip"'})
+        self.assertEqual(self.srmock.status, '304 Not Modified')
+
+    def test_response_cache(self):
+        self.app = self.create_app(response_cache_size=10, etags=True)
+        for i in range(3):
+            response, = self.simulate_request('/catalog/1', method='GET', headers={'Accept': 'application/json'})
+            self.assertEqual(self.srmock.status, '200 OK')
+            self.assertEqual(json.loads(response.decode('utf-8')), {'name': 'unnamed', 'page': None})
+        self.assertEqual(self.catalog_resource.calls, 1)
+        etag = self.srmock.headers_dict['ETag']
+
+        # Other route parameters and selected query parameters are cached apart
+        self.simulate_request('/catalog/2', method='GET', headers={'Accept': 'application/json'})
+        response, = self.simulate_request('/catalog/1', method='GET', query_string='page=2&other=1', headers={'Accept': 'application/json'})
+        self.assertEqual(json.loads(response.decode('utf-8')), {'name': 'unnamed', 'page': '2'})
+        self.simulate_request('/catalog/1', method='GET', query_string='page=2&other=2', headers={'Accept': 'application/json'})
+        self.assertEqual(self.catalog_resource.calls, 3)
+
+        # Cached responses still answer conditional requests
+        self.simulate_request('/catalog/1', method='GET', headers={'Accept': 'application/json', 'If-None-Match': etag})
+        self.assertEqual(self.srmock.status, '304 Not Modified')
+
+        self.simulate_request('/catalog/1', method='PUT', body=json.dumps({'name': 'renamed'}), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        self.assertEqual(self.srmock.status, '204 No Content')
+        response, = self.simulate_request('/catalog/1', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(json.loads(response.decode('utf-8')), {'name': 'renamed', 'page': None})
+        self.simulate_request('/catalog/2', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(self.catalog_resource.calls, 4)
+
+        stats = self.translator.response_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (5, 4))
+
+        # Headers set by the responder are replayed
+        response, = self.simulate_request('/catalog/1', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(self.catalog_resource.calls, 4)
+        self.assertEqual(self.srmock.headers_dict['Cache-Control'], 'max-age=60')
+
+    def test_response_cache_instances(self):
+        self.app = self.create_app(response_cache_size=10)
+        other = CatalogResource()
+        other.names['1'] = 'other'
+        self.app.add_route('/other_catalog/{id}', other)
+        response, = self.simulate_request('/catalog/1', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(json.loads(response.decode('utf-8'))['name'], 'unnamed')
+        response, = self.simulate_request('/other_catalog/1', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(json.loads(response.decode('utf-8'))['name'], 'other')
+
+        # Invalidating an instance leaves the others cached
+        self.translator.invalidate(other)
+        self.simulate_request('/catalog/1', method='GET', headers={'Accept': 'application/json'})
+        self.simulate_request('/other_catalog/1', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual((self.catalog_resource.calls, other.calls), (1, 2))
+
+        self.translator.invalidate(CatalogResource)
+        self.simulate_request('/catalog/1', method='GET', headers={'Accept': 'application/json'})
+        self.simulate_request('/other_catalog/1', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual((self.catalog_resource.calls, other.calls), (2, 3))
+
+    def test_response_cache_disabled(self):
+        for i in range(2):
+            self.simulate_request('/catalog/1', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(self.catalog_resource.calls, 2)
+
+    def test_fields(self):
+        self.app = self.create_app(fields_param='fields')
+        response, = self.simulate_request('/people', method='GET', query_string='fields=id,email', headers={'Accept': 'application/json'})
+        self.assertEqual(self.srmock.status, '200 OK')
+        self.assertEqual(json.loads(response.decode('utf-8')), [{'id': 1, 'email': 'alice@example.com'}, {'id': 2, 'email': 'bob@example.com'}])
+        self.assertEqual(self.people_resource.fields, frozenset(['id', 'email']))
+        self.assertEqual(self.handler.logs, [])
+
+        response, = self.simulate_request('/people', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(len(json.loads(response.decode('utf-8'))[0]), 3)
+
+        self.people_resource.fields = None
+        response, = self.simulate_request('/people', method='GET', query_string='fields=id,password', headers={'Accept': 'application/json'})
+        self.assertEqual(self.srmock.status, '400 Bad Request')
+        self.assertEqual(json.loads(response.decode('utf-8'))['description'], 'Unknown fields: password')
+        self.assertIsNone(self.people_resource.fields)
+
+        self.streaming_resource.rows = [{'id': i, 'name': str(i)} for i in range(10)]
+        response = self.simulate_request('/streaming_response', method='GET', query_string='fields=id', headers={'Accept': 'application/json'})
+        self.assertEqual(json.loads(b''.join(response).decode('utf-8')), [{'id': i} for i in range(10)])
+
+    def test_projected_validators_per_validator(self):
+        # A validator whose id was reused must not get another's projection
+        fields = frozenset(['id'])
+        first = jsonschema.Draft4Validator({'type': 'object', 'properties': {'id': {'type': 'integer'}}})
+        projected = falconjsonio.middleware._get_projected_validator(first, fields)
+        second = jsonschema.Draft4Validator({'type': 'object', 'properties': {'id': {'type': 'string'}}})
+        falconjsonio.middleware._projected_validators.set((id(second), fields), (first, projected))
+        projected = falconjsonio.middleware._get_projected_validator(second, fields)
+        self.assertTrue(projected.is_valid({'id': 'a'}))
+        self.assertFalse(projected.is_valid({'id': 1}))
+
+    def test_fields_disabled(self):
+        response, = self.simulate_request('/people', method='GET', query_string='fields=id', headers={'Accept': 'application/json'})
+        self.assertEqual(len(json.loads(response.decode('utf-8'))[0]), 3)
+
+    def test_schema_encoder_matches_interpreted(self):
+        schema = {
+            'type': 'object',
+            'properties': {
+                'id':    {'type': 'integer', 'minimum': 1, 'maximum': 5, 'exclusiveMaximum': True},
+                'name':  {'type': ['string', 'null'], 'pattern': '^x', 'maxLength': 3},
+                'kind':  {'enum': [1, 'x', None, True]},
+                'tags':  {'type': 'array', 'items': {'type': 'string'}, 'minItems': 1},
+                'value': {'type': 'number'},
+                'flag':  {'type': 'boolean'},
+                'meta':  {'type': 'object', 'additionalProperties': {'type': 'integer'}},
+            },
+            'required': ['id'],
+            'additionalProperties': False,
+        }
+        validator = jsonschema.Draft4Validator(schema)
+        encoder = falconjsonio.compiler.SchemaEncoder(validator)
+        for instance in [
+            {'id': 1}, {'id': 5}, {'id': True}, {'id': 1.0}, {}, [], None, {'id': 2, 'extra': 1},
+            {'id': 2, 'name': 'xyz'}, {'id': 2, 'name': 'xyzz'}, {'id': 2, 'name': 'abc'}, {'id': 2, 'name': None},
+            {'id': 2, 'kind': 1}, {'id': 2, 'kind': True}, {'id': 2, 'kind': 'y'},
+            {'id': 2, 'tags': []}, {'id': 2, 'tags': ['a', 'caf\xe9 "\\']}, {'id': 2, 'tags': [1]},
+            {'id': 2, 'value': 1}, {'id': 2, 'value': 1.5}, {'id': 2, 'value': 1e300}, {'id': 2, 'value': 'a'},
+            {'id': 2, 'flag': False}, {'id': 2, 'flag': 0},
+            {'id': 2, 'meta': {}}, {'id': 2, 'meta': {'a': 1, 'b': 2}}, {'id': 2, 'meta': {'a': 'b'}},
+            {'tags': ['a'], 'id': 2, 'name': 'x', 'kind': None, 'flag': True},
+        ]:
+            encoded = encoder.encode(instance)
+            self.assertEqual(encoded is not None, validator.is_valid(instance), instance)
+            if encoded is not None:
+                self.assertEqual(json.loads(encoded.decode('utf-8')), instance)
+
+    def test_schema_encoder_objects(self):
+        encoder = falconjsonio.compiler.SchemaEncoder(jsonschema.Draft4Validator(PersonResource.on_get.__response_schema__.schema))
+        self.assertEqual(json.loads(encoder.encode(Person(1, 'Alice', ['a'])).decode('utf-8')), {'id': 1, 'name': 'Alice', 'tags': ['a']})
+        self.assertIsNone(encoder.encode(Person(1, 'Alice', [2])))
+
+        encoder = falconjsonio.compiler.SchemaEncoder(jsonschema.Draft4Validator({'type': 'array', 'items': {'type': 'object', 'properties': {'id': {'type': 'integer'}}}}))
+        self.assertEqual(json.loads(encoder.encode([Person(1, 'Alice', []), {'id': 2}]).decode('utf-8')), [{'id': 1, 'name': 'Alice', 'tags': []}, {'id': 2}])
+        self.assertIsNone(encoder.encode([object()]))
+
+    def test_schema_encoding(self):
+        self.app = self.create_app(schema_encoding=True)
+        response, = self.simulate_request('/good_response', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(json.loads(response.decode('utf-8')), {'id': 12345})
+
+        response, = self.simulate_request('/person', method='GET', headers={'Accept': 'application/json'})
+        self.assertEqual(json.loads(response.decode('utf-8')), {'id': 1, 'name': 'Alice', 'tags': ['a', 'b']})
+
+        # Invalid results are reported as usual
+        self.simulate_request('/bad_response', method='POST', body=json.dumps({'email': 'foo@example.com', 'password': 'hunter2'}), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        self.assertEqual(self.srmock.status, '500 Internal Server Error')
+        self.assertTrue(self.handler.logs[0].message.startswith("Blocking proposed response from being sent from falconjsonio.test.BadResource.on_post to client as it does not match the defined schema: 'email' is a required property"))
+
+    def test_schema_encoding_fields(self):
+        self.app = self.create_app(schema_encoding=True, fields_param='fields')
+        response, = self.simulate_request('/person', method='GET', query_string='fields=name', headers={'Accept': 'application/json'})
+        self.assertEqual(json.loads(response.decode('utf-8')), {'name': 'Alice'})
+
+    def test_line_splitter(self):
+        body = b'{"id": 1}\n\n  {"id": 2}\r\n{"id": 3}'
+        splitter = falconjsonio.ndjson.LineSplitter()
+        lines = []
+        for i in range(len(body)):
+            lines.extend(splitter.feed(body[i:i + 1]))
+        lines.extend(splitter.close())
+        self.assertEqual(lines, [(1, b'{"id": 1}'), (3, b'{"id": 2}'), (4, b'{"id": 3}')])
+
+        splitter = falconjsonio.ndjson.LineSplitter(max_line_size=8)
+        self.assertEqual(splitter.feed(b'{"id":1}\n{"id"'), [(1, b'{"id":1}')])
+        self.assertRaises(falconjsonio.ndjson.LineTooLong, splitter.feed, b':10}')
+
+        splitter = falconjsonio.ndjson.LineSplitter(max_size=12)
+        self.assertEqual(splitter.feed(b'{"id":1}\n'), [(1, b'{"id":1}')])
+        self.assertRaises(falconjsonio.ndjson.BodyTooLarge, splitter.feed, b'{"id":2}\n')
+
+    def test_ndjson_reject(self):
+        self.app = self.create_app(ndjson='reject', chunk_size=7)
+        body = '\n'.join(json.dumps({'id': i}) for i in range(100)) + '\n'
+        response, = self.simulate_request('/ingest', method='POST', body=body, headers={'Accept': 'application/json', 'Content-Type': 'application/x-ndjson'})
+        self.assertEqual(self.srmock.status, '200 OK')
+        self.assertEqual(json.loads(response.decode('utf-8')), {'count': 100, 'skipped': []})
+        self.assertEqual(self.ingest_resource.received, [{'id': i} for i in range(100)])
+
+        response, = self.simulate_request('/ingest', method='POST', body='{"id": 1}\n{"id": "x"}\n{"id": 3}', headers={'Accept': 'application/json', 'Content-Type': 'application/x-ndjson'})
+        self.assertEqual(self.srmock.status, '400 Bad Request')
+        self.assertEqual(json.loads(json.loads(response.decode('utf-8'))['description'])['line'], 2)
+        self.assertEqual(self.ingest_resource.received, [{'id': 1}])
+
+        response, = self.simulate_request('/ingest', method='POST', body='{"id": 1}\n{"id": ', headers={'Accept': 'application/json', 'Content-Type': 'application/x-ndjson'})
+        self.assertEqual(self.srmock.status, '400 Bad Request')
+        self.assertEqual(json.loads(response.decode('utf-8'))['title'], 'Malformed JSON')
+
+    def test_ndjson_skip(self):
+        self.app = self.create_app(ndjson='skip', error_mode='first')
+        body = '{"id": 1}\n{"id": "x"}\nnope\n\n{"id": 4}\n'
+        response, = self.simulate_request('/ingest', method='POST', body=body, headers={'Accept': 'application/json', 'Content-Type': 'application/x-ndjson; charset=utf-8'})
+        self.assertEqual(self.srmock.status, '200 OK')
+        self.assertEqual(json.loads(response.decode('utf-8')), {
+            'count': 2,
+            'skipped': [
+                {'line': 2, 'reason': 'invalid', 'errors': [{'path': '/id', 'keyword': 'type'}]},
+                {'line': 3, 'reason': 'malformed'},
+            ],
+        })
+        self.assertEqual(self.ingest_resource.received, [{'id': 1}, {'id': 4}])
+
+    def test_ndjson_limits(self):
+        headers = {'Accept': 'application/json', 'Content-Type': 'application/x-ndjson'}
+        self.simulate_request('/ingest', method='POST', body='{"id": 1}\n', headers=headers)
+        self.assertEqual(self.srmock.status, '415 Unsupported Media Type')
+
+        # The body size limit is for the whole body, declared or read, and
+        # the line size limit for each line
+        self.app = self.create_app(ndjson='reject', max_body_size=100, max_line_size=16)
+        response, = self.simulate_request('/ingest', method='POST', body='{"id": 1}\n' * 10, headers=headers)
+        self.assertEqual(self.srmock.status, '200 OK')
+        self.assertEqual(json.loads(response.decode('utf-8'))['count'], 10)
+        self.ingest_resource.received = None
+        self.simulate_request('/ingest', method='POST', body='{"id": 1}\n' * 11, headers=headers)
+        self.assertEqual(self.srmock.status, '413 Payload Too Large')
+        self.assertIsNone(self.ingest_resource.received)
+        self.simulate_request('/ingest', method='POST', body='{"id": 1}\n{"id": 1000000000000}\n', headers=headers)
+        self.assertEqual(self.srmock.status, '413 Payload Too Large')
+
+        self.simulate_request('/ingest', method='POST', body=gzip.compress(b'{"id": 1}\n'), headers=dict(headers, **{'Content-Encoding': 'gzip'}))
+        self.assertEqual(self.srmock.status, '415 Unsupported Media Type')
+
+    def test_ndjson_schemas(self):
+        registry = falconjsonio.registry.SchemaRegistry()
+        registry.register('row', {'type': 'object', 'properties': {'id': {'type': 'integer'}}, 'required': ['id']})
+        registry.register('rows', {'type': 'array', 'items': {'$ref': 'row'}})
+        self.app = self.create_app(ndjson='reject')
+        headers = {'Accept': 'application/json', 'Content-Type': 'application/x-ndjson'}
+        for index, schema in enumerate([{'$ref': 'rows'}, {'$ref': 'row'}]):
+            resource = falconjsonio.schema.request_schema(schema, method_name='on_post', registry=registry)(type('RowsResource', (RowsResource,), {}))([])
+            self.app.add_route('/rows/{0}'.format(index), resource)
+            response, = self.simulate_request('/rows/{0}'.format(index), method='POST', body='{"id": 1}\n{"id": 2}\n', headers=headers)
+            self.assertEqual(self.srmock.status, '200 OK', schema)
+            self.assertEqual(resource.rows, [{'id': 1}, {'id': 2}])
+            self.simulate_request('/rows/{0}'.format(index), method='POST', body='{"id": 1}\n{"nope": 2}\n', headers=headers)
+            self.assertEqual(self.srmock.status, '400 Bad Request', schema)
+
+        # Records cannot be validated against tuples
+        validator = falconjsonio.schema.request_schema({'type': 'array', 'items': [{'type': 'integer'}]}).validator
+        self.assertRaises(ValueError, falconjsonio.middleware._get_record_validator, validator)
+
+    def test_patch_apply(self):
+        # Examples from RFC 7386 and RFC 6902
+        patch = falconjsonio.patch.parse(falconjsonio.patch.MERGE_PATCH, {'title': 'Hello!', 'author': {'familyName': None}, 'phoneNumber': '+01-123-456-7890', 'tags': ['example']})
+        target = {'title': 'Goodbye!', 'author': {'givenName': 'John', 'familyName': 'Doe'}, 'tags': ['example', 'sample'], 'content': 'This will be unchanged'}
+        self.assertEqual(patch.apply(target), {'title': 'Hello!', 'author': {'givenName': 'John'}, 'tags': ['example'], 'content': 'This will be unchanged', 'phoneNumber': '+01-123-456-7890'})
+        self.assertEqual(target['title'], 'Goodbye!')
+        self.assertEqual(sorted(patch.operations), [
+            ('add', ('phoneNumber',), '+01-123-456-7890', None),
+            ('add', ('tags',), ['example'], None),
+            ('add', ('title',), 'Hello!', None),
+            ('remove', ('author', 'familyName'), None, None),
+        ])
+
+        patch = falconjsonio.patch.parse(falconjsonio.patch.JSON_PATCH, [
+            {'op': 'test', 'path': '/a/b/c', 'value': 'foo'},
+            {'op': 'remove', 'path': '/a/b/c'},
+            {'op': 'add', 'path': '/a/b/c', 'value': ['foo', 'bar']},
+            {'op': 'replace', 'path': '/a/b/c', 'value': 42},
+            {'op': 'move', 'path': '/a/d', 'from': '/a/b/c'},
+            {'op': 'copy', 'path': '/a/d~1e', 'from': '/a/d'},
+            {'op': 'add', 'path': '/f/-', 'value': 2},
+            {'op': 'add', 'path': '/f/0', 'value': 0},
+        ])
+        self.assertEqual(patch.apply({'a': {'b': {'c': 'foo'}}, 'f': [1]}), {'a': {'b': {}, 'd': 42, 'd/e': 42}, 'f': [0, 1, 2]})
+
+        for operations in [
+            [{'op': 'test', 'path': '/a', 'value': 2}],
+            [{'op': 'remove', 'path': '/b'}],
+            [{'op': 'add', 'path': '/f/5', 'value': 1}],
+            [{'op': 'move', 'path': '/a/b', 'from': '/a'}],
+        ]:
+            patch = falconjsonio.patch.parse(falconjsonio.patch.JSON_PATCH, operations)
+            self.assertRaises(falconjsonio.patch.PatchError, patch.apply, {'a': 1, 'f': []})
+        for document in [{}, [{'op': 'jump', 'path': '/a'}], [{'op': 'add', 'path': '/a'}], [{'op': 'remove', 'path': 'a'}]]:
+            self.assertRaises(falconjsonio.patch.PatchError, falconjsonio.patch.parse, falconjsonio.patch.JSON_PATCH, document)
+
+    def test_patch_schema_at(self):
+        definitions = {'zip': {'type': 'string'}}
+        schema = {
+            'type': 'object',
+            'properties': {
+                'address':  {'$ref': '#/definitions/zip'},
+                'point':    {'type': 'array', 'items': [{'type': 'number'}], 'additionalItems': False},
+                'name':     {},
+            },
+            'patternProperties': {'^x-': {'type': 'integer'}},
+            'allOf': [{'properties': {'name': {'maxLength': 3}}}],
+            'anyOf': [{'properties': {'name': {'type': 'string'}}}, {'properties': {'name': {'type': 'null'}}}],
+            'additionalProperties': False,
+            'definitions': definitions,
+        }
+        resolve = lambda ref: definitions['zip']
+        self.assertEqual(falconjsonio.patch.schema_at(schema, ('address',), resolve), {'type': 'string'})
+        self.assertEqual(falconjsonio.patch.schema_at(schema, ('point', '0'), resolve), {'type': 'number'})
+        self.assertIsNone(falconjsonio.patch.schema_at(schema, ('point', '1'), resolve))
+        self.assertIsNone(falconjsonio.patch.schema_at(schema, ('point', 'x'), resolve))
+        self.assertEqual(falconjsonio.patch.schema_at(schema, ('x-count',), resolve), {'type': 'integer'})
+        self.assertIsNone(falconjsonio.patch.schema_at(schema, ('other',), resolve))
+        self.assertEqual(falconjsonio.patch.schema_at(schema, ('name',), resolve), {'allOf': [{'maxLength': 3}, {'anyOf': [{'type': 'string'}, {'type': 'null'}]}]})
+
+    def test_merge_patch(self):
+        self.app = self.create_app(patches=True, error_mode='first')
+        headers = {'Accept': 'application/json', 'Content-Type': 'application/merge-patch+json'}
+        response, = self.simulate_request('/account', method='PATCH', body=json.dumps({'name': 'Bob', 'address': {'zip': '12345'}}), headers=headers)
+        self.assertEqual(self.srmock.status, '200 OK')
+        self.assertEqual(json.loads(response.decode('utf-8')), {'name': 'Bob', 'email': 'alice@example.com', 'address': {'city': 'Oslo', 'zip': '12345'}, 'tags': []})
+        self.assertEqual(self.account_resource.received.media_type, 'application/merge-patch+json')
+
+        self.account_resource.received = None
+        for patch, title, errors in [
+            ({'address': {'zip': 'abc'}}, 'Invalid request body', [{'path': '/address/zip', 'keyword': 'pattern'}]),
+            ({'name': 'A very long name'}, 'Invalid request body', [{'path': '/name', 'keyword': 'maxLength'}]),
+            ({'email': None}, 'Invalid patch', None),
+            ({'address': {'city': None}}, 'Invalid patch', None),
+            ({'phone': '555'}, 'Invalid patch', None),
+            ({'name': {'first': 'Bob'}}, 'Invalid patch', None),
+            ({'name': {}}, 'Invalid patch', None),
+        ]:
+            response, = self.simulate_request('/account', method='PATCH', body=json.dumps(patch), headers=headers)
+            self.assertEqual(self.srmock.status, '400 Bad Request', patch)
+            response = json.loads(response.decode('utf-8'))
+            self.assertEqual(response['title'], title)
+            self.assertEqual(response.get('errors'), errors)
+        self.assertIsNone(self.account_resource.received)
+
+        # Optional members can be removed
+        response, = self.simulate_request('/account', method='PATCH', body=json.dumps({'tags': None}), headers=headers)
+        self.assertEqual(self.srmock.status, '200 OK')
+        self.assertNotIn('tags', json.loads(response.decode('utf-8')))
+
+        # Empty objects are merged, changing nothing
+        response, = self.simulate_request('/account', method='PATCH', body=json.dumps({'address': {}}), headers=headers)
+        self.assertEqual(self.srmock.status, '200 OK')
+        self.assertEqual(json.loads(response.decode('utf-8'))['address'], {'city': 'Oslo', 'zip': '12345'})
+
+    def test_json_patch(self):
+        self.app = self.create_app(patches=True, error_mode='first')
+        headers = {'Accept': 'application/json', 'Content-Type': 'application/json-patch+json'}
+        operations = [
+            {'op': 'add', 'path': '/tags/-', 'value': 'new'},
+            {'op': 'replace', 'path': '/address/city', 'value': 'Bergen'},
+            {'op': 'test', 'path': '/name', 'value': 'Alice'},
+            {'op': 'copy', 'path': '/tags/-', 'from': '/tags/0'},
+        ]
+        response, = self.simulate_request('/account', method='PATCH', body=json.dumps(operations), headers=headers)
+        self.assertEqual(self.srmock.status, '200 OK')
+        self.assertEqual(json.loads(response.decode('utf-8')), {'name': 'Alice', 'email': 'alice@example.com', 'address': {'city': 'Bergen'}, 'tags': ['new', 'new']})
+        self.assertEqual(self.account_resource.received.operations[0], ('add', ('tags', '-'), 'new', None))
+
+        for operations, title in [
+            ([{'op': 'add', 'path': '/tags/0', 'value': 1}], 'Invalid request body'),
+            ([{'op': 'add', 'path': '/address/street', 'value': 'Main St'}], 'Invalid patch'),
+            ([{'op': 'move', 'path': '/nickname', 'from': '/name'}], 'Invalid patch'),
+            ([{'op': 'copy', 'path': '/tags/-', 'from': '/name'}], 'Invalid patch'),
+            ([{'op': 'move', 'path': '/name', 'from': '/address/city'}], 'Invalid patch'),
+            ([{'op': 'remove'}], 'Malformed patch'),
+            ({'op': 'remove', 'path': '/tags'}, 'Malformed patch'),
+        ]:
+            response, = self.simulate_request('/account', method='PATCH', body=json.dumps(operations), headers=headers)
+            self.assertEqual(self.srmock.status, '400 Bad Request', operations)
+            self.assertEqual(json.loads(response.decode('utf-8'))['title'], title)
+
+    def test_patch_disabled(self):
+        self.simulate_request('/account', method='PATCH', body=json.dumps({'name': 'Bob'}), headers={'Accept': 'application/json', 'Content-Type': 'application/merge-patch+json'})
+        self.assertEqual(self.srmock.status, '415 Unsupported Media Type')
+
+    def test_batch(self):
+        self.app.add_route('/batch', falconjsonio.batch.BatchResource(self.app))
+        self.app.add_route('/other_batch', falconjsonio.batch.BatchResource(self.app))
+        operations = [
+            {'method': 'POST', 'path': '/good_response', 'body': {'email': 'foo@example.com', 'password': 'hunter2'}},
+            {'method': 'POST', 'path': '/good_response', 'body': {'email': 'foo@example.com'}},
+            {'method': 'GET', 'path': '/good_response'},
+            {'method': 'PUT', 'path': '/good_response', 'body': {}},
+            {'method': 'GET', 'path': '/missing'},
+            {'method': 'POST', 'path': '/batch?x=1', 'body': []},
+            {'method': 'POST', 'path': '/other_batch', 'body': [{'method': 'PUT', 'path': '/catalog/1', 'body': {'name': 'nested'}}]},
+        ]
+        response, = self.simulate_request('/batch', method='POST', body=json.dumps(operations), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        self.assertEqual(self.srmock.status, '200 OK')
+        results = json.loads(response.decode('utf-8'))
+        self.assertEqual([result['status'] for result in results], [201, 400, 200, 405, 404, 400, 400])
+        self.assertEqual(results[0]['body'], {'email': 'foo@example.com'})
+        self.assertEqual(results[1]['body']['title'], 'Invalid request body')
+        self.assertEqual(results[2]['body'], {'id': 12345})
+        self.assertEqual(results[5]['body']['description'], 'Batches cannot be nested')
+        self.assertEqual(results[6]['body']['description'], 'Batches cannot be nested')
+        self.assertNotIn('1', self.catalog_resource.names)
+        self.assertEqual(self.good_resource.received, {'email': 'foo@example.com', 'password': 'hunter2'})
+
+        # Operations must be well-formed
+        self.simulate_request('/batch', method='POST', body=json.dumps([{'method': 'TRACE', 'path': '/good_response'}]), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        self.assertEqual(self.srmock.status, '400 Bad Request')
+
+    def test_batch_encodings(self):
+        self.app = self.create_app(compression_threshold=10, formats=[falconjsonio.codec.MsgpackCodec()])
+        self.app.add_route('/batch', falconjsonio.batch.BatchResource(self.app))
+        self.streaming_resource.rows = [{'id': i} for i in range(100)]
+        operations = [
+            {'method': 'GET', 'path': '/streaming_response', 'headers': {'Accept-Encoding': 'gzip'}},
+            {'method': 'GET', 'path': '/streaming_response', 'headers': {'Accept': 'application/msgpack'}},
+            {'method': 'POST', 'path': '/good_response', 'body': {'email': 'foo@example.com', 'password': 'hunter2'}, 'headers': {'Content-Encoding': 'gzip'}},
+        ]
+        response, = self.simulate_request('/batch', method='POST', body=json.dumps(operations), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        self.assertEqual(self.srmock.status, '200 OK')
+        results = json.loads(response.decode('utf-8'))
+        self.assertEqual([result['status'] for result in results], [200, 200, 201])
+        self.assertEqual(results[0]['body'], self.streaming_resource.rows)
+        self.assertEqual(results[1]['body'], self.streaming_resource.rows)
+        self.assertNotIn('content-encoding', results[0]['headers'])
+        self.assertEqual(results[2]['body'], {'email': 'foo@example.com'})
+
+        # Responses that cannot be decoded fail on their own
+        def app(environ, start_response):
+            if environ['PATH_INFO'] == '/broken':
+                start_response('200 OK', [('Content-Type', 'application/json')])
+                return [b'\x1f\x8b\x08']
+            return self.app(environ, start_response)
+        self.app.add_route('/broken_batch', falconjsonio.batch.BatchResource(app))
+        operations = [{'method': 'GET', 'path': '/broken'}, {'method': 'GET', 'path': '/good_response'}]
+        response, = self.simulate_request('/broken_batch', method='POST', body=json.dumps(operations), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        self.assertEqual(self.srmock.status, '200 OK')
+        results = json.loads(response.decode('utf-8'))
+        self.assertEqual([result['status'] for result in results], [500, 200])
+        self.assertEqual(results[1]['body'], {'id': 12345})
+
+    def test_batch_concurrent(self):
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            self.app.add_route('/batch', falconjsonio.batch.BatchResource(self.app, executor=executor, max_operations=50))
+            operations = [{'method': 'POST', 'path': '/schemaless_json_response', 'body': {'n': i}} for i in range(50)]
+            response, = self.simulate_request('/batch', method='POST', body=json.dumps(operations), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+            self.assertEqual(self.srmock.status, '200 OK')
+            self.assertEqual([result['body'] for result in json.loads(response.decode('utf-8'))], [{'n': i} for i in range(50)])
+
+            response, = self.simulate_request('/batch', method='POST', body=json.dumps(operations + operations[:1]), headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+            self.assertEqual(self.srmock.status, '400 Bad Request')
+            self.assertEqual(json.loads(response.decode('utf-8'))['title'], 'Too many operations')
+
+@unittest.skipUnless(hasattr(falcon, 'asgi'), 'ASGI requires Falcon 3')
+class AsyncIOTest(unittest.TestCase):
+    def setUp(self):
+        super(AsyncIOTest, self).setUp()
+        self.executor = concurrent.futures.ThreadPoolExecutor(1)
+        self.translator = falconjsonio.middleware.JSONTranslator(offload_threshold=16, executor=self.executor, max_body_size=256)
+        self.app = falcon.asgi.App(
+            middleware=[
+                falconjsonio.middleware.RequireJSON(),
+                self.translator,
+            ],
+        )
+        self.resource = AsyncResource()
+        self.app.add_route('/async_response', self.resource)
+        self.client = falcon.testing.TestClient(self.app)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        super(AsyncIOTest, self).tearDown()
+
+    def test_post(self):
+        result = self.client.simulate_post('/async_response', json={'email': 'foo@example.com', 'password': 'hunter2'})
+        self.assertEqual(result.status, falcon.HTTP_201)
+        self.assertEqual(result.json, {'email': 'foo@example.com'})
+        self.assertEqual(self.resource.received, {'email': 'foo@example.com', 'password': 'hunter2'})
+
+    def test_nonconforming_post(self):
+        result = self.client.simulate_post('/async_response', json={'email': 'foo@example.com'})
+        self.assertEqual(result.status, falcon.HTTP_400)
+        self.assertEqual(self.resource.received, None)
+
+    def test_unsupported_content_type(self):
+        result = self.client.simulate_post('/async_response', body='hello', headers={'Content-Type': 'text/plain'})
+        self.assertEqual(result.status, falcon.HTTP_415)
+
+    def test_body_too_large(self):
+        result = self.client.simulate_post('/async_response', json={'email': 'foo@example.com', 'password': 'x' * 256})
+        self.assertEqual(result.status, falcon.HTTP_413)
+
+    def test_streamed_result(self):
+        result = self.client.simulate_get('/async_response')
+        self.assertEqual(result.status, falcon.HTTP_200)
+        self.assertEqual(result.json, list(range(10)))
+        # Sync streams are consumed on the executor rather than the event loop
+        self.assertNotIn(threading.get_ident(), self.resource.threads)
+
+    def test_async_streamed_result(self):
+        for count in [0, 10, 1000]:
+            result = self.client.simulate_get('/async_response', query_string='source=async&count={0}'.format(count))
+            self.assertEqual(result.status, falcon.HTTP_200)
+            self.assertEqual(json.loads(result.text), list(range(count)))
+
+        result = self.client.simulate_get('/async_response', query_string='source=async&count=1000&invalid=500')
+        self.assertRaises(ValueError, json.loads, result.text)
+        self.assertTrue(result.text.startswith('[0,'))
+
+    def test_ndjson(self):
+        app = falcon.asgi.App(
+            middleware=[
+                falconjsonio.middleware.RequireJSON(ndjson=True),
+                falconjsonio.middleware.JSONTranslator(ndjson='skip'),
+            ],
+        )
+        app.add_route('/ingest', AsyncIngestResource())
+        body = '{"id": 1}\n{"id": "x"}\n{"id": 3}\n'
+        result = falcon.testing.TestClient(app).simulate_post('/ingest', body=body, headers={'Content-Type': 'application/x-ndjson'})
+        self.assertEqual(result.status, falcon.HTTP_200)
+        self.assertEqual(result.json['received'], [{'id': 1}, {'id': 3}])
+        self.assertEqual([skipped['line'] for skipped in result.json['skipped']], [2])